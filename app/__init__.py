@@ -2,26 +2,64 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from celery import Celery
+from kombu import Queue
 from app.config import Config
-import logging
-from logging.handlers import RotatingFileHandler
 
 # Initialize extensions
 db = SQLAlchemy()
 migrate = Migrate()
 celery = Celery(__name__, broker=Config.CELERY_BROKER_URL, backend=Config.CELERY_RESULT_BACKEND)
 
+# Downloads and resizes go to separate queues. Workers started without -Q consume
+# all of them; production runs an I/O pool on the fetch queue and a prefork pool
+# on the transform queue (see k8s/celery-deployment.yaml).
+celery.conf.update(
+    CELERY_QUEUES=(
+        Queue('celery'),
+        Queue(Config.CELERY_FETCH_QUEUE),
+        Queue(Config.CELERY_TRANSFORM_QUEUE),
+    ),
+    CELERY_ROUTES={
+        'app.tasks.image_tasks.process_images_task': {'queue': Config.CELERY_FETCH_QUEUE},
+        'app.tasks.image_tasks.process_product_batch_task': {'queue': Config.CELERY_FETCH_QUEUE},
+        'app.tasks.image_tasks.transform_images_task': {'queue': Config.CELERY_TRANSFORM_QUEUE},
+        'app.tasks.image_tasks.transform_product_batch_task': {'queue': Config.CELERY_TRANSFORM_QUEUE},
+    },
+)
+
 def create_app():
     app = Flask(__name__)
 
     # Load configuration from Config class
     app.config.from_object(Config)
 
+    # Take the client address from trusted proxies' X-Forwarded-For
+    if app.config['PROXY_FIX_X_FOR']:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    # Pool sizing, recycling and timeouts from the DB_* settings
+    from app.utils.db_utils import engine_options
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
     celery.conf.update(app.config)
 
+    # Pool usage metrics for /metrics
+    from app.metrics import instrument_engine
+    with app.app_context():
+        instrument_engine(db.engine)
+
+    # Read-through cache for product responses
+    from app.utils.response_cache import init_product_cache
+    init_product_cache(app)
+
+    # Background dependency checks for the health routes
+    from app.utils.health_monitor import init_health_monitor
+    init_health_monitor(app)
+
     # Setup middleware
     from app.middleware import setup_middleware
     setup_middleware(app)
@@ -30,11 +68,15 @@ def create_app():
     from app.routes import register_blueprints
     register_blueprints(app)
 
-    # Logging configuration
+    # Logging configuration: JSON lines written by a background thread
     if not app.debug:
-        handler = RotatingFileHandler('app.log', maxBytes=10240, backupCount=10)
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        app.logger.addHandler(handler)
-        app.logger.setLevel(logging.INFO)
+        from app.utils.log_utils import configure_logging
+        configure_logging(
+            app.logger,
+            log_file=app.config['LOG_FILE'],
+            max_bytes=app.config['LOG_MAX_BYTES'],
+            backup_count=app.config['LOG_BACKUP_COUNT'],
+            queue_size=app.config['LOG_QUEUE_SIZE']
+        )
 
     return app
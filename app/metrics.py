@@ -0,0 +1,152 @@
+"""Prometheus metrics for the API, Celery tasks, image pipeline and database pool
+
+When PROMETHEUS_MULTIPROC_DIR is set (gunicorn and prefork Celery workers),
+every process writes its samples to files in that directory and a scrape
+aggregates them all; otherwise metrics live in the process's default registry.
+"""
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency',
+    ['blueprint', 'endpoint', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served', multiprocess_mode='livesum'
+)
+
+CELERY_TASK_DURATION = Histogram(
+    'celery_task_duration_seconds', 'Celery task run time', ['task', 'state'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+IMAGE_STAGE_DURATION = Histogram(
+    'image_stage_duration_seconds', 'Time spent on one product in an image pipeline stage', ['stage'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+IMAGE_RENDER_DURATION = Histogram(
+    'image_render_duration_seconds', 'Decode, resize and save time for one source image',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+IMAGES_PROCESSED = Counter(
+    'images_processed_total', 'Images handled by each pipeline stage', ['stage', 'outcome']
+)
+IMAGE_BYTES_DOWNLOADED = Counter('image_bytes_downloaded_total', 'Bytes of source images downloaded')
+
+DB_POOL_SIZE = Gauge('db_pool_size', 'Configured connection pool size', multiprocess_mode='livesum')
+DB_POOL_MAX_OVERFLOW = Gauge(
+    'db_pool_max_overflow', 'Connections allowed beyond the pool size', multiprocess_mode='livesum'
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up after the pool timeout'
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out', 'Connections currently checked out of the pool', multiprocess_mode='livesum'
+)
+
+# Start times of running Celery tasks in this process, by task id
+_task_started = {}
+
+
+def render_metrics():
+    """Return (payload, content_type) for a scrape"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    """
+    Track pool capacity and checked out connections for a SQLAlchemy engine.
+    Capacity is reported by the process that opens the pool's first connection,
+    so short-lived processes that only import the app (CLI commands, probes)
+    and forked children that replaced their pool are counted correctly.
+    """
+    reported_pid = []
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        if reported_pid == [os.getpid()]:
+            return
+        reported_pid[:] = [os.getpid()]
+        size = getattr(engine.pool, 'size', None)
+        if callable(size):
+            DB_POOL_SIZE.set(size())
+        max_overflow = getattr(engine.pool, '_max_overflow', None)
+        if isinstance(max_overflow, int):
+            DB_POOL_MAX_OVERFLOW.set(max(max_overflow, 0))
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+
+
+def init_celery_metrics(port=None):
+    """
+    Record task durations through Celery signals. With port set, the worker's
+    main process also serves the aggregated metrics of all its children.
+    """
+    from celery.signals import task_postrun, task_prerun, worker_init, worker_process_shutdown
+
+    @task_prerun.connect(weak=False)
+    def on_task_prerun(task_id=None, **kwargs):
+        _task_started[task_id] = time.monotonic()
+
+    @task_postrun.connect(weak=False)
+    def on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+        started = _task_started.pop(task_id, None)
+        if started is not None:
+            CELERY_TASK_DURATION.labels(task=task.name, state=state or 'UNKNOWN').observe(time.monotonic() - started)
+
+    if port:
+        @worker_init.connect(weak=False)
+        def on_worker_init(**kwargs):
+            from prometheus_client import start_http_server
+
+            if MULTIPROC_DIR:
+                registry = CollectorRegistry()
+                multiprocess.MultiProcessCollector(registry)
+                start_http_server(port, registry=registry)
+            else:
+                start_http_server(port)
+
+    @worker_process_shutdown.connect(weak=False)
+    def on_worker_process_shutdown(pid=None, **kwargs):
+        if MULTIPROC_DIR:
+            multiprocess.mark_process_dead(pid or os.getpid())
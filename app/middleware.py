@@ -1,29 +1,74 @@
 """Middleware for request logging and rate limiting"""
 from flask import request, g
 from functools import wraps
-from datetime import datetime, timedelta
+import random
+import threading
 import time
 import logging
 
+from app.config import Config
+from app.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT
+from app.utils.rate_limiter import create_rate_limiter
+
 logger = logging.getLogger(__name__)
 
-# Simple in-memory rate limiting (for production, use Redis)
-rate_limit_store = {}
+# Rate limiter backend, built on first use from Config.RATE_LIMIT_STORAGE_URL
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return this process's rate limiter, creating it on first use"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = create_rate_limiter(Config.RATE_LIMIT_STORAGE_URL)
+    return _rate_limiter
 
 def request_logger(app):
-    """Middleware to log all incoming requests"""
+    """
+    Middleware to time and log requests.
+    Each request is logged once, after the response. Errors and slow requests
+    are always logged; other requests are sampled at LOG_REQUEST_SAMPLE_RATE.
+    """
+    sample_rate = app.config['LOG_REQUEST_SAMPLE_RATE']
+    slow_seconds = app.config['LOG_SLOW_REQUEST_SECONDS']
+
     @app.before_request
-    def log_request():
+    def start_request():
         g.start_time = time.time()
-        logger.info(f"Request: {request.method} {request.path} from {request.remote_addr}")
+        HTTP_REQUESTS_IN_FLIGHT.inc()
     
     @app.after_request
     def log_response(response):
         if hasattr(g, 'start_time'):
             elapsed = time.time() - g.start_time
-            logger.info(f"Response: {request.method} {request.path} - {response.status_code} ({elapsed:.3f}s)")
+            HTTP_REQUEST_DURATION.labels(
+                blueprint=request.blueprint or '',
+                endpoint=request.endpoint or 'unmatched',
+                method=request.method,
+                status=response.status_code
+            ).observe(elapsed)
+            if response.status_code >= 400 or elapsed >= slow_seconds or random.random() < sample_rate:
+                logger.info(
+                    f"{request.method} {request.path} - {response.status_code} ({elapsed:.3f}s)",
+                    extra={
+                        'method': request.method,
+                        'path': request.path,
+                        'status': response.status_code,
+                        'duration_ms': round(elapsed * 1000, 1),
+                        'remote_addr': request.remote_addr
+                    }
+                )
         return response
     
+    @app.teardown_request
+    def end_request(exc):
+        # Runs even when a response could not be produced
+        if hasattr(g, 'start_time'):
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+    
     return app
 
 def rate_limit(max_requests=100, window_seconds=60):
@@ -32,42 +77,22 @@ def rate_limit(max_requests=100, window_seconds=60):
     Args:
         max_requests: Maximum number of requests allowed in the time window
         window_seconds: Time window in seconds
+    Counts are kept by the backend from get_rate_limiter(): in memory per
+    process by default, or in Redis so limits hold across workers and pods.
     """
     def decorator(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            # Get client identifier (IP address)
-            client_id = request.remote_addr
-            current_time = datetime.utcnow()
-            
-            # Create key for this endpoint and client
-            key = f"{f.__name__}:{client_id}"
-            
-            # Initialize or get existing record
-            if key not in rate_limit_store:
-                rate_limit_store[key] = {
-                    'count': 0,
-                    'reset_time': current_time + timedelta(seconds=window_seconds)
-                }
-            
-            record = rate_limit_store[key]
-            
-            # Reset if window has passed
-            if current_time > record['reset_time']:
-                record['count'] = 0
-                record['reset_time'] = current_time + timedelta(seconds=window_seconds)
-            
-            # Check rate limit
-            if record['count'] >= max_requests:
-                retry_after = int((record['reset_time'] - current_time).total_seconds())
+            # Key on endpoint and client (IP address)
+            key = f"{f.__name__}:{request.remote_addr}"
+
+            allowed, retry_after = get_rate_limiter().hit(key, max_requests, window_seconds)
+            if not allowed:
                 return {
                     'error': 'Rate limit exceeded',
                     'retry_after': retry_after
-                }, 429
-            
-            # Increment counter
-            record['count'] += 1
-            
+                }, 429, {'Retry-After': str(retry_after)}
+
             return f(*args, **kwargs)
         return wrapped
     return decorator
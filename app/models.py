@@ -1,3 +1,5 @@
+import hashlib
+from datetime import datetime
 from . import db
 
 class Product(db.Model):
@@ -10,12 +12,79 @@ class Product(db.Model):
     def __repr__(self):
         return f'<Product {self.serial_number} - {self.product_name}>'
 
+def _input_url_hash(context):
+    # Rows built through the ORM get their key from the URL; bulk upserts pass it explicitly
+    return hashlib.sha256(context.get_current_parameters()['input_image_url'].encode('utf-8')).hexdigest()
+
 class Image(db.Model):
     __tablename__ = 'images'
+    # One row per input URL per product, so redelivered tasks upsert instead of duplicating.
+    # URLs are keyed by hash, since btree entries on long URLs exceed the index row size.
+    # The leading product_id column also serves per-product lookups and counts.
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'url_hash', name='uq_images_product_id_url_hash'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
     input_image_url = db.Column(db.Text, nullable=False)
+    url_hash = db.Column(db.String(64), nullable=False, default=_input_url_hash)  # sha256 of input_image_url
     output_image_url = db.Column(db.Text)
+    renditions = db.Column(db.JSON)  # rendition name -> output path
 
     def __repr__(self):
         return f'<Image {self.id} for Product {self.product_id}>'
+
+class ImageSource(db.Model):
+    """HTTP validators and stored output for an input image URL, used for conditional re-fetches"""
+    __tablename__ = 'image_sources'
+    url_hash = db.Column(db.String(64), primary_key=True)  # sha256 of input_image_url
+    input_image_url = db.Column(db.Text, nullable=False)
+    etag = db.Column(db.String(255))
+    last_modified = db.Column(db.String(64))
+    content_length = db.Column(db.BigInteger)
+    content_hash = db.Column(db.String(64), nullable=False)
+    output_image_url = db.Column(db.Text, nullable=False)
+    checked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ImageSource {self.input_image_url}>'
+
+class UploadJob(db.Model):
+    __tablename__ = 'upload_jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='PENDING')
+    total_rows = db.Column(db.Integer, nullable=False, default=0)
+    total_images = db.Column(db.Integer, nullable=False, default=0)
+    total_batches = db.Column(db.Integer, nullable=False, default=0)
+    completed_batches = db.Column(db.Integer, nullable=False, default=0)
+    images_done = db.Column(db.Integer, nullable=False, default=0)
+    images_failed = db.Column(db.Integer, nullable=False, default=0)
+    images_rejected = db.Column(db.Integer, nullable=False, default=0)  # subset of images_failed hit by safety limits
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    renditions = db.Column(db.JSON)  # per-upload rendition spec, None uses Config.IMAGE_RENDITIONS
+
+    def to_dict(self):
+        finished_at = self.completed_at or datetime.utcnow()
+        elapsed = max((finished_at - self.created_at).total_seconds(), 0.0) if self.created_at else 0.0
+        images_processed = self.images_done + self.images_failed
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'total_rows': self.total_rows,
+            'total_images': self.total_images,
+            'total_batches': self.total_batches,
+            'completed_batches': self.completed_batches,
+            'images_done': self.images_done,
+            'images_failed': self.images_failed,
+            'images_rejected': self.images_rejected,
+            'elapsed_seconds': round(elapsed, 3),
+            'images_per_second': round(images_processed / elapsed, 3) if elapsed else 0.0,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'error': self.error
+        }
+
+    def __repr__(self):
+        return f'<UploadJob {self.id} {self.status}>'
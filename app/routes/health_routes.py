@@ -1,8 +1,7 @@
 """Health check and monitoring routes"""
-from flask import Blueprint, jsonify
-from app import db, celery
-import psutil
-import os
+from flask import Blueprint, Response, jsonify
+from app.metrics import render_metrics
+from app.utils.health_monitor import get_health_monitor
 from datetime import datetime
 
 health_bp = Blueprint('health', __name__)
@@ -18,55 +17,32 @@ def health_check():
 
 @health_bp.route('/health/detailed', methods=['GET'])
 def detailed_health_check():
-    """Detailed health check with all dependencies"""
+    """Detailed health check with all dependencies, from the background sampler's last snapshot"""
+    snapshot = get_health_monitor().snapshot()
     health_status = {
-        'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat(),
+        'status': snapshot['status'],
+        'timestamp': snapshot.get('timestamp'),
+        'age_seconds': snapshot['age_seconds'],
         'service': 'image-processing-api',
-        'checks': {}
+        'checks': snapshot['checks']
     }
-    
-    # Database check
-    try:
-        db.session.execute(db.text('SELECT 1'))
-        health_status['checks']['database'] = {'status': 'healthy'}
-    except Exception as e:
-        health_status['checks']['database'] = {'status': 'unhealthy', 'error': str(e)}
-        health_status['status'] = 'unhealthy'
-    
-    # Celery broker check
-    try:
-        celery_status = celery.control.inspect().active()
-        if celery_status is not None:
-            health_status['checks']['celery'] = {
-                'status': 'healthy',
-                'workers': len(celery_status)
-            }
-        else:
-            health_status['checks']['celery'] = {'status': 'degraded', 'message': 'No workers active'}
-    except Exception as e:
-        health_status['checks']['celery'] = {'status': 'unhealthy', 'error': str(e)}
-        health_status['status'] = 'unhealthy'
-    
-    # System resources
-    health_status['checks']['system'] = {
-        'cpu_percent': psutil.cpu_percent(interval=1),
-        'memory_percent': psutil.virtual_memory().percent,
-        'disk_percent': psutil.disk_usage('/').percent
-    }
-    
     status_code = 200 if health_status['status'] == 'healthy' else 503
     return jsonify(health_status), status_code
 
 @health_bp.route('/health/ready', methods=['GET'])
 def readiness_check():
     """Kubernetes readiness probe endpoint"""
-    try:
-        # Check if database is accessible
-        db.session.execute(db.text('SELECT 1'))
-        return jsonify({'status': 'ready'}), 200
-    except Exception as e:
-        return jsonify({'status': 'not ready', 'error': str(e)}), 503
+    # Check if database is accessible, sharing recent pings between probes
+    error = get_health_monitor().db_ping()
+    if error:
+        return jsonify({'status': 'not ready', 'error': error}), 503
+    return jsonify({'status': 'ready'}), 200
+
+@health_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint, aggregated across all worker processes"""
+    payload, content_type = render_metrics()
+    return Response(payload, headers={'Content-Type': content_type})
 
 @health_bp.route('/health/live', methods=['GET'])
 def liveness_check():
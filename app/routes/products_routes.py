@@ -1,14 +1,31 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from app.config import Config
 from app.models import Product, Image, db
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
+from sqlalchemy import func, or_
 from app.middleware import rate_limit
+from app.utils.pagination import encode_cursor, keyset_page, total_count
+from app.utils.response_cache import cached_response, get_product_cache, invalidate_products, product_key
+import json
 
 products_routes = Blueprint('products', __name__, url_prefix='/api/products')
 
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+SEARCH_MODES = ('contains', 'prefix')
+
+
+def _list_key():
+    # Listings are keyed by query string under a generation that any product write bumps
+    return f"list:{get_product_cache().generation('list')}:{sorted(request.args.items(multi=True))}"
+
 
 @products_routes.route('', methods=['GET'])
 @rate_limit(max_requests=100, window_seconds=60)
+@cached_response(_list_key)
 def list_products():
     """List all products with their image counts, with pagination and search"""
     try:
@@ -16,35 +33,68 @@ def list_products():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         search = request.args.get('search', '', type=str)
+        search_mode = request.args.get('search_mode', 'contains', type=str)
+        cursor = request.args.get('cursor', type=str)
         
         # Validate pagination parameters
-        per_page = min(per_page, 100)  # Maximum 100 items per page
+        per_page = max(1, min(per_page, 100))  # Between 1 and 100 items per page
+        if search_mode not in SEARCH_MODES:
+            return jsonify({'error': f"search_mode must be one of: {', '.join(SEARCH_MODES)}"}), 400
         
         # Build query with optional search
-        query = Product.query
+        filtered = Product.query
         if search:
-            search_pattern = f'%{search}%'
-            query = query.filter(
-                or_(
-                    Product.serial_number.ilike(search_pattern),
-                    Product.product_name.ilike(search_pattern)
+            escaped = _escape_like(search)
+            if search_mode == 'prefix':
+                # Anchored match on serial numbers uses the varchar_pattern_ops btree index
+                filtered = filtered.filter(Product.serial_number.like(f'{escaped}%', escape='\\'))
+            else:
+                # Substring matches are served by the pg_trgm GIN indexes on PostgreSQL
+                search_pattern = f'%{escaped}%'
+                filtered = filtered.filter(
+                    or_(
+                        Product.serial_number.ilike(search_pattern, escape='\\'),
+                        Product.product_name.ilike(search_pattern, escape='\\')
+                    )
                 )
-            )
+        
+        # Count images with a correlated subquery so the page is served in one query
+        # instead of lazily loading every product's images
+        image_count = (
+            db.select(func.count(Image.id))
+            .where(Image.product_id == Product.id)
+            .correlate(Product)
+            .scalar_subquery()
+        )
+        query = filtered.add_columns(image_count.label('image_count')).order_by(Product.id)
+        
+        # Keyset pagination is opt-in via ?cursor= (empty for the first page)
+        if cursor is not None:
+            try:
+                rows, has_next = keyset_page(query, Product.id, cursor, per_page)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            pagination = {
+                'per_page': per_page,
+                'next_cursor': encode_cursor(rows[-1][0].id) if has_next else None,
+                'has_next': has_next
+            }
+            if request.args.get('include_total', 'false').lower() == 'true':
+                pagination['total'], pagination['total_is_estimate'] = total_count(
+                    filtered, Product.__tablename__, filter_key=(search_mode, search) if search else None
+                )
+            
+            return jsonify({
+                'products': [_product_summary(product, count) for product, count in rows],
+                'pagination': pagination
+            }), 200
         
         # Execute paginated query
         paginated = query.paginate(page=page, per_page=per_page, error_out=False)
         
-        result = []
-        for product in paginated.items:
-            result.append({
-                'id': product.id,
-                'serial_number': product.serial_number,
-                'product_name': product.product_name,
-                'image_count': len(product.images)
-            })
-        
         return jsonify({
-            'products': result,
+            'products': [_product_summary(product, count) for product, count in paginated.items],
             'pagination': {
                 'page': paginated.page,
                 'per_page': paginated.per_page,
@@ -58,7 +108,22 @@ def list_products():
         return jsonify({'error': str(e)}), 500
 
 
+def _escape_like(term):
+    """Escape LIKE wildcards so user input is matched literally"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _product_summary(product, image_count):
+    return {
+        'id': product.id,
+        'serial_number': product.serial_number,
+        'product_name': product.product_name,
+        'image_count': image_count
+    }
+
+
 @products_routes.route('/<int:product_id>', methods=['GET'])
+@cached_response(product_key, namespace='product')
 def get_product(product_id):
     """Get a single product with all its images"""
     try:
@@ -66,7 +131,8 @@ def get_product(product_id):
         images = [{
             'id': img.id,
             'input_image_url': img.input_image_url,
-            'output_image_url': img.output_image_url
+            'output_image_url': img.output_image_url,
+            'renditions': img.renditions
         } for img in product.images]
         
         return jsonify({
@@ -95,6 +161,7 @@ def create_product():
         
         db.session.add(product)
         db.session.commit()
+        invalidate_products()
         
         return jsonify({
             'id': product.id,
@@ -124,6 +191,7 @@ def update_product(product_id):
             product.product_name = data['product_name']
         
         db.session.commit()
+        invalidate_products([product_id])
         
         return jsonify({
             'id': product.id,
@@ -147,6 +215,7 @@ def delete_product(product_id):
         product = Product.query.get_or_404(product_id)
         db.session.delete(product)
         db.session.commit()
+        invalidate_products([product_id])
         
         return jsonify({'message': 'Product deleted successfully'}), 200
     except Exception as e:
@@ -156,19 +225,75 @@ def delete_product(product_id):
 
 @products_routes.route('/images', methods=['GET'])
 def list_all_images():
-    """List all images across all products"""
+    """List images across all products, paginated by id or streamed as an export"""
     try:
-        images = Image.query.all()
-        result = []
-        for img in images:
-            result.append({
-                'id': img.id,
-                'product_id': img.product_id,
-                'product_name': img.product.product_name,
-                'serial_number': img.product.serial_number,
-                'input_image_url': img.input_image_url,
-                'output_image_url': img.output_image_url
-            })
-        return jsonify({'images': result}), 200
+        # Products are joined in the same query instead of one lookup per image
+        query = db.session.query(Image, Product.product_name, Product.serial_number).join(
+            Product, Image.product_id == Product.id
+        )
+        
+        export_format = request.args.get('format', type=str)
+        if export_format is not None:
+            if export_format not in EXPORT_MIMETYPES:
+                return jsonify({'error': f"format must be one of: {', '.join(EXPORT_MIMETYPES)}"}), 400
+            stmt = (
+                db.select(Image, Product.product_name, Product.serial_number)
+                .join(Product, Image.product_id == Product.id)
+                .order_by(Image.id)
+            )
+            return Response(
+                stream_with_context(_stream_images(stmt, export_format)),
+                mimetype=EXPORT_MIMETYPES[export_format]
+            )
+        
+        # Paginated by default; omit cursor or pass an empty one for the first page
+        cursor = request.args.get('cursor', '', type=str)
+        per_page = max(1, min(request.args.get('per_page', 50, type=int), 500))
+        try:
+            rows, has_next = keyset_page(query, Image.id, cursor, per_page)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        pagination = {
+            'per_page': per_page,
+            'next_cursor': encode_cursor(rows[-1][0].id) if has_next else None,
+            'has_next': has_next
+        }
+        if request.args.get('include_total', 'false').lower() == 'true':
+            pagination['total'], pagination['total_is_estimate'] = total_count(Image.query, Image.__tablename__)
+        
+        return jsonify({
+            'images': [_image_summary(img, product_name, serial_number) for img, product_name, serial_number in rows],
+            'pagination': pagination
+        }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+
+def _stream_images(stmt, export_format):
+    """Yield every image as NDJSON lines or a JSON array, reading from a server-side cursor"""
+    # yield_per streams rows in fixed-size batches so memory stays flat regardless of table size
+    rows = db.session.execute(stmt.execution_options(yield_per=Config.EXPORT_YIELD_PER))
+    if export_format == 'ndjson':
+        for img, product_name, serial_number in rows:
+            yield json.dumps(_image_summary(img, product_name, serial_number)) + '\n'
+        return
+
+    yield '['
+    separator = ''
+    for img, product_name, serial_number in rows:
+        yield separator + json.dumps(_image_summary(img, product_name, serial_number))
+        separator = ','
+    yield ']'
+
+
+def _image_summary(img, product_name, serial_number):
+    return {
+        'id': img.id,
+        'product_id': img.product_id,
+        'product_name': product_name,
+        'serial_number': serial_number,
+        'input_image_url': img.input_image_url,
+        'output_image_url': img.output_image_url,
+        'renditions': img.renditions
+    }
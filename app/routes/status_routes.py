@@ -1,37 +1,118 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from celery.backends.base import BaseKeyValueStoreBackend
 from celery.result import AsyncResult
 from app import celery
+from app.config import Config
+from app.models import UploadJob, db
+import json
+import threading
+import time
 
 status = Blueprint('status', __name__)
 
+# Job states after which progress can no longer change
+JOB_FINAL_STATES = ('COMPLETED', 'FAILED')
+
+# Bounds the gunicorn threads a worker can spend on open job event streams
+_job_event_streams = threading.BoundedSemaphore(Config.JOB_EVENTS_MAX_STREAMS)
+
 @status.route('/status/<task_id>', methods=['GET'])
 def check_status(task_id):
     # Check the status of the given task ID using Celery's AsyncResult
     task_result = AsyncResult(task_id, app=celery)
 
-    if task_result.state == 'PENDING':
+    return jsonify(_format_task_status(task_id, task_result.state, task_result.info))
+
+
+@status.route('/status/bulk', methods=['POST'])
+def check_status_bulk():
+    # Resolve many task and job IDs in one request instead of one poll per ID
+    data = request.get_json(silent=True) or {}
+    task_ids = data.get('task_ids') or []
+    job_ids = data.get('job_ids') or []
+
+    if not isinstance(task_ids, list) or not isinstance(job_ids, list):
+        return jsonify({'error': 'task_ids and job_ids must be lists'}), 400
+    if not task_ids and not job_ids:
+        return jsonify({'error': 'task_ids or job_ids is required'}), 400
+    if len(task_ids) + len(job_ids) > Config.STATUS_BULK_MAX_IDS:
+        return jsonify({'error': f'At most {Config.STATUS_BULK_MAX_IDS} IDs can be requested at once'}), 400
+
+    task_states = _fetch_task_states(task_ids)
+    tasks = [_format_task_status(task_id, *task_states[task_id]) for task_id in task_ids]
+
+    jobs = []
+    if job_ids:
+        found = {job.id: job for job in UploadJob.query.filter(UploadJob.id.in_(job_ids))}
+        for job_id in job_ids:
+            job = found.get(job_id)
+            jobs.append(job.to_dict() if job else {'job_id': job_id, 'error': 'Job not found'})
+
+    return jsonify({'tasks': tasks, 'jobs': jobs})
+
+
+def _fetch_task_states(task_ids, backend=None):
+    """
+    Look up the state of many tasks.
+    Key/value result backends (e.g. Redis) are read with a single MGET; other
+    backends fall back to one AsyncResult lookup per task.
+    Returns:
+        Dict mapping task_id to (state, info)
+    """
+    backend = backend or celery.backend
+    task_ids = list(dict.fromkeys(task_ids))
+    if not task_ids:
+        return {}
+
+    if isinstance(backend, BaseKeyValueStoreBackend):
+        try:
+            values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+        except NotImplementedError:
+            values = None
+        if values is not None:
+            if hasattr(values, 'items'):
+                values = [values.get(backend.get_key_for_task(task_id)) for task_id in task_ids]
+            states = {}
+            for task_id, value in zip(task_ids, values):
+                if value is None:
+                    states[task_id] = ('PENDING', None)
+                else:
+                    meta = backend.decode_result(value)
+                    states[task_id] = (meta['status'], meta['result'])
+            return states
+
+    states = {}
+    for task_id in task_ids:
+        task_result = AsyncResult(task_id, app=celery, backend=backend)
+        states[task_id] = (task_result.state, task_result.info)
+    return states
+
+
+def _format_task_status(task_id, state, info):
+    if state == 'PENDING':
         response = {
             'task_id': task_id,
             'status': 'PENDING',
             'result': None
         }
-    elif task_result.state == 'PROGRESS':
+    elif state == 'PROGRESS':
         response = {
             'task_id': task_id,
             'status': 'PROGRESS',
-            'result': None
+            'result': None,
+            'progress': info  # Throttled meta published by the task, see TaskProgress
         }
-    elif task_result.state == 'SUCCESS':
+    elif state == 'SUCCESS':
         response = {
             'task_id': task_id,
             'status': 'SUCCESS',
-            'result': task_result.result  # Assuming the result is directly the processed data
+            'result': info  # Assuming the result is directly the processed data
         }
-    elif task_result.state == 'FAILURE':
+    elif state == 'FAILURE':
         response = {
             'task_id': task_id,
             'status': 'FAILURE',
-            'result': str(task_result.info)  # Error message from the task
+            'result': str(info)  # Error message from the task
         }
     else:
         response = {
@@ -40,4 +121,64 @@ def check_status(task_id):
             'result': None
         }
 
-    return jsonify(response)
+    return response
+
+
+@status.route('/jobs/<job_id>', methods=['GET'])
+def check_job_status(job_id):
+    # Aggregate progress for an upload job, read from a single row
+    job = db.session.get(UploadJob, job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify(job.to_dict())
+
+
+@status.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_status(job_id):
+    # Server-sent events: push job progress to the client whenever it changes.
+    # Each open stream holds a gunicorn thread (see gunicorn.conf.py) for up to JOB_EVENTS_MAX_SECONDS
+    if not db.session.get(UploadJob, job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    if not _job_event_streams.acquire(blocking=False):
+        # Clients fall back to polling /jobs/<job_id> rather than queueing for a thread
+        response = jsonify({'error': 'Too many open job event streams, poll /jobs/<job_id> instead'})
+        response.headers['Retry-After'] = str(int(Config.JOB_EVENTS_INTERVAL) or 1)
+        return response, 503
+
+    interval = Config.JOB_EVENTS_INTERVAL
+    deadline = time.monotonic() + Config.JOB_EVENTS_MAX_SECONDS
+
+    def generate():
+        last_progress = None
+        while True:
+            db.session.expire_all()
+            job = db.session.get(UploadJob, job_id)
+            payload = job.to_dict()
+            # Elapsed time and throughput change every tick, so only the counters decide whether to send
+            progress = {k: v for k, v in payload.items() if k not in ('elapsed_seconds', 'images_per_second')}
+            if progress != last_progress:
+                last_progress = progress
+                yield f"data: {json.dumps(payload)}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+
+            if job.status in JOB_FINAL_STATES:
+                yield "event: done\ndata: {}\n\n"
+                return
+            if time.monotonic() >= deadline:
+                # The client's EventSource reconnects and resumes from the current state
+                return
+
+            # Hand the connection back to the pool while sleeping
+            db.session.close()
+            time.sleep(interval)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Closed when the stream ends or the client disconnects
+    response.call_on_close(_job_event_streams.release)
+    return response
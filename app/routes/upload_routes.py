@@ -1,10 +1,14 @@
 from flask import Blueprint, request, jsonify
 import csv
-import re
-from app.tasks.image_tasks import process_images_task
-from app.models import Product, db
-import uuid
+import json
 import os
+import uuid
+from app.tasks.upload_tasks import ingest_upload_task
+from app.models import UploadJob, db
+from app.config import Config
+from app.utils.csv_utils import upload_path
+from app.utils.csv_validator import REQUIRED_COLUMNS
+from app.utils.image_utils import parse_renditions
 
 upload_routes = Blueprint('upload_routes', __name__)
 
@@ -14,55 +18,60 @@ def upload_csv():
     if not file or not file.filename.endswith('.csv'):
         return jsonify({"error": "No file provided or file is not a CSV"}), 400
 
-    temp_file_path = os.path.join('tmp', f"{uuid.uuid4().hex}.csv")
-    os.makedirs(os.path.dirname(temp_file_path), exist_ok=True)
-    file.save(temp_file_path)
-
-    try:
-        with open(temp_file_path, 'r') as f:
-            csv_reader = csv.reader(f)
-            headers = next(csv_reader)
+    # Optional per-upload rendition spec overriding Config.IMAGE_RENDITIONS
+    renditions = request.form.get('renditions')
+    if renditions:
+        try:
+            renditions = json.loads(renditions)
+            parse_renditions(renditions)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid renditions: {e}"}), 400
+    else:
+        renditions = None
 
-            if headers != ['Serial Number', 'Product Name', 'Input Image Urls']:
-                return jsonify({"error": "CSV format is incorrect. Header row should be ['Serial Number', 'Product Name', 'Input Image Urls']"}), 400
+    # Persist the raw file to the upload folder; with shared storage parsing happens in a worker
+    job_id = uuid.uuid4().hex
+    file_path = upload_path(job_id)
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    file.save(file_path)
 
-            tasks = []
-            for row in csv_reader:
-                if len(row) != 3:
-                    return jsonify({"error": "CSV format is incorrect. Each row should have 3 columns."}), 400
+    try:
+        # Only the header is checked on the request path so bad files still fail fast
+        try:
+            with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+                headers = next(csv.reader(f), None)
+        except (csv.Error, UnicodeDecodeError):
+            headers = None
 
-                serial_number, product_name, image_urls = row
+        if headers != REQUIRED_COLUMNS:
+            os.remove(file_path)
+            return jsonify({"error": "CSV format is incorrect. Header row should be ['Serial Number', 'Product Name', 'Input Image Urls']"}), 400
 
-                image_urls_list = [url.strip() for url in image_urls.split(',')]
-                invalid_urls = [url for url in image_urls_list if not is_valid_url(url)]
-                if invalid_urls:
-                    return jsonify({"error": f"Invalid image URLs found: {', '.join(invalid_urls)}"}), 400
+        job = UploadJob(id=job_id, status='PENDING', renditions=renditions)
+        db.session.add(job)
+        db.session.commit()
 
-                product = Product.query.filter_by(serial_number=serial_number, product_name=product_name).first()
-                if not product:
-                    product = Product(serial_number=serial_number, product_name=product_name)
-                    db.session.add(product)
-                    db.session.commit()
+        if not Config.UPLOAD_SHARED_STORAGE:
+            # Workers cannot read this process's disk: parse here, and only the image batches go through the broker
+            response = ingest_upload_task(job.id)
+            if response['status'] == 'FAILED':
+                return jsonify(response), 400
+            response['status_url'] = f"/jobs/{job.id}"
+            return jsonify(response), 202
 
-                task = process_images_task.delay(product.id, image_urls_list)
-                tasks.append(task.id)
+        try:
+            ingest_upload_task.delay(job.id)
+        except Exception as e:
+            job.status = 'FAILED'
+            job.error = f"Failed to enqueue ingestion: {e}"
+            db.session.commit()
+            raise
 
-            return jsonify({"task_ids": tasks}), 202
-    except csv.Error:
-        return jsonify({"error": "Error reading CSV file"}), 500
+        response = job.to_dict()
+        response['status_url'] = f"/jobs/{job.id}"
+        return jsonify(response), 202
     except Exception as e:
+        db.session.rollback()
+        if os.path.exists(file_path):
+            os.remove(file_path)
         return jsonify({"error": str(e)}), 500
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-
-def is_valid_url(url):
-    regex = re.compile(
-        r'^(?:http|ftp)s?://' 
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  
-        r'localhost|'  
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|'  
-        r'\[?[A-F0-9]*:[A-F0-9:]+\]?)'  
-        r'(?::\d+)?'  
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return re.match(regex, url) is not None
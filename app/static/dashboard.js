@@ -66,8 +66,8 @@ uploadBtn.addEventListener('click', async () => {
       return;
     }
     
-    showMessage(uploadResult, `✅ Successfully submitted ${data.task_ids.length} task(s) for processing!`, 'success');
-    displayTaskIds(data.task_ids);
+    showMessage(uploadResult, '✅ Upload accepted! Rows are being processed in the background.', 'success');
+    displayJobId(data.job_id);
     
     csvInput.value = '';
     fileNameSpan.textContent = 'Choose CSV file...';
@@ -80,19 +80,17 @@ uploadBtn.addEventListener('click', async () => {
   }
 });
 
-function displayTaskIds(taskIds) {
-  taskList.innerHTML = '<h3>Task IDs:</h3>';
+function displayJobId(jobId) {
+  taskList.innerHTML = '<h3>Job ID:</h3>';
   const ul = document.createElement('ul');
   ul.className = 'task-id-list';
   
-  taskIds.forEach(id => {
-    const li = document.createElement('li');
-    li.innerHTML = `
-      <code>${id}</code>
-      <button class="btn-small" onclick="checkTaskById('${id}')">Check</button>
-    `;
-    ul.appendChild(li);
-  });
+  const li = document.createElement('li');
+  li.innerHTML = `
+    <code>${jobId}</code>
+    <button class="btn-small" onclick="checkTaskById('${jobId}')">Check</button>
+  `;
+  ul.appendChild(li);
   
   taskList.appendChild(ul);
 }
@@ -119,6 +117,16 @@ async function checkTaskStatus() {
   showMessage(statusResult, 'Fetching status...', 'info');
   
   try {
+    // Upload job IDs are tried first; anything else is treated as a Celery task ID
+    stopTaskPolling();
+    const jobResp = await fetch('/jobs/' + encodeURIComponent(id));
+    if (jobResp.ok) {
+      const job = await jobResp.json();
+      displayJobStatus(job);
+      watchJob(job);
+      return;
+    }
+    
     const resp = await fetch('/status/' + encodeURIComponent(id));
     const data = await resp.json();
     
@@ -128,6 +136,7 @@ async function checkTaskStatus() {
     }
     
     displayStatus(data);
+    pollTask(data);
     
   } catch (err) {
     showMessage(statusResult, '❌ Network error: ' + err.message, 'error');
@@ -158,15 +167,122 @@ function displayStatus(data) {
   const emoji = statusEmoji[data.status] || '❓';
   const statusClass = data.status.toLowerCase();
   
+  const progress = data.progress;
+  
   statusResult.innerHTML = `
     <div class="status-card ${statusClass}">
       <h3>${emoji} Status: ${data.status}</h3>
       <p><strong>Task ID:</strong> <code>${data.task_id}</code></p>
+      ${progress ? `
+        <p><strong>Stage:</strong> ${progress.stage}</p>
+        <p><strong>Images:</strong> ${progress.images_done} done, ${progress.images_failed} failed of ${progress.images_total}</p>
+        <p><strong>Throughput:</strong> ${progress.images_per_second} images/s, ${(progress.bytes_per_second / 1024).toFixed(1)} KB/s over ${progress.elapsed_seconds}s</p>
+      ` : ''}
       ${data.result ? `<div class="result-data"><strong>Result:</strong><pre>${JSON.stringify(data.result, null, 2)}</pre></div>` : ''}
     </div>
   `;
 }
 
+// Tasks publish progress at most about once a second, so refreshing faster gains nothing
+const TASK_POLL_INTERVAL_MS = 2000;
+let taskPollTimer = null;
+
+function stopTaskPolling() {
+  if (taskPollTimer) {
+    clearTimeout(taskPollTimer);
+    taskPollTimer = null;
+  }
+}
+
+function pollTask(data) {
+  stopTaskPolling();
+  if (data.status !== 'PENDING' && data.status !== 'PROGRESS') return;
+  
+  taskPollTimer = setTimeout(async () => {
+    taskPollTimer = null;
+    try {
+      const resp = await fetch('/status/' + encodeURIComponent(data.task_id));
+      if (!resp.ok) return;
+      const next = await resp.json();
+      displayStatus(next);
+      pollTask(next);
+    } catch (err) {
+      // Leave the last status on screen; the user can re-check manually
+    }
+  }, TASK_POLL_INTERVAL_MS);
+}
+
+// Live job progress is pushed over server-sent events instead of polling
+let jobEvents = null;
+
+function watchJob(job) {
+  if (jobEvents) {
+    jobEvents.close();
+    jobEvents = null;
+  }
+  stopTaskPolling();
+  if (job.status === 'COMPLETED' || job.status === 'FAILED') return;
+  
+  const source = new EventSource('/jobs/' + encodeURIComponent(job.job_id) + '/events');
+  jobEvents = source;
+  source.onmessage = (e) => {
+    job = JSON.parse(e.data);
+    displayJobStatus(job);
+  };
+  source.addEventListener('done', () => {
+    source.close();
+    if (jobEvents === source) jobEvents = null;
+  });
+  // The server refuses streams beyond its per-worker limit; poll instead of reconnecting
+  source.onerror = () => {
+    if (source.readyState !== EventSource.CLOSED || jobEvents !== source) return;
+    jobEvents = null;
+    pollJob(job);
+  };
+}
+
+function pollJob(job) {
+  stopTaskPolling();
+  if (job.status === 'COMPLETED' || job.status === 'FAILED') return;
+  
+  taskPollTimer = setTimeout(async () => {
+    taskPollTimer = null;
+    try {
+      const resp = await fetch('/jobs/' + encodeURIComponent(job.job_id));
+      if (!resp.ok) return;
+      const next = await resp.json();
+      displayJobStatus(next);
+      pollJob(next);
+    } catch (err) {
+      // Leave the last status on screen; the user can re-check manually
+    }
+  }, TASK_POLL_INTERVAL_MS);
+}
+
+function displayJobStatus(data) {
+  const statusEmoji = {
+    'COMPLETED': '✅',
+    'FAILED': '❌',
+    'PENDING': '⏳',
+    'INGESTING': '📥',
+    'QUEUED': '🔄'
+  };
+  
+  const emoji = statusEmoji[data.status] || '❓';
+  const statusClass = {'COMPLETED': 'success', 'FAILED': 'failure', 'INGESTING': 'progress', 'QUEUED': 'progress'}[data.status] || 'pending';
+  
+  statusResult.innerHTML = `
+    <div class="status-card ${statusClass}">
+      <h3>${emoji} Status: ${data.status}</h3>
+      <p><strong>Job ID:</strong> <code>${data.job_id}</code></p>
+      <p><strong>Batches:</strong> ${data.completed_batches} / ${data.total_batches} (${data.total_rows} rows)</p>
+      <p><strong>Images:</strong> ${data.images_done} done, ${data.images_failed} failed of ${data.total_images}</p>
+      <p><strong>Throughput:</strong> ${data.images_per_second} images/s over ${data.elapsed_seconds}s</p>
+      ${data.error ? `<p><strong>Error:</strong> ${data.error}</p>` : ''}
+    </div>
+  `;
+}
+
 // ===== PRODUCTS TAB =====
 async function loadProducts() {
   const tbody = document.getElementById('productsTableBody');
@@ -324,15 +440,18 @@ async function deleteProduct(id) {
 }
 
 // ===== IMAGES TAB =====
-async function loadImages() {
+// Images are served in keyset pages; "Load more" follows next_cursor
+async function loadImages(cursor = '') {
   const tbody = document.getElementById('imagesTableBody');
   const resultDiv = document.getElementById('imagesResult');
   
-  tbody.innerHTML = '<tr><td colspan="6" class="loading">Loading images...</td></tr>';
+  if (!cursor) {
+    tbody.innerHTML = '<tr><td colspan="6" class="loading">Loading images...</td></tr>';
+  }
   resultDiv.innerHTML = '';
   
   try {
-    const resp = await fetch('/api/products/images');
+    const resp = await fetch('/api/products/images?cursor=' + encodeURIComponent(cursor));
     const data = await resp.json();
     
     if (!resp.ok) {
@@ -341,12 +460,12 @@ async function loadImages() {
       return;
     }
     
-    if (data.images.length === 0) {
+    if (!cursor && data.images.length === 0) {
       tbody.innerHTML = '<tr><td colspan="6" class="empty">No images found. Upload a CSV to process images!</td></tr>';
       return;
     }
     
-    tbody.innerHTML = data.images.map(img => `
+    const rows = data.images.map(img => `
       <tr>
         <td>${img.id}</td>
         <td>${img.product_name}</td>
@@ -359,6 +478,16 @@ async function loadImages() {
       </tr>
     `).join('');
     
+    if (cursor) {
+      tbody.insertAdjacentHTML('beforeend', rows);
+    } else {
+      tbody.innerHTML = rows;
+    }
+    
+    if (data.pagination.has_next) {
+      resultDiv.innerHTML = `<button class="btn-small" onclick="loadImages('${data.pagination.next_cursor}')">Load more</button>`;
+    }
+    
   } catch (err) {
     showMessage(resultDiv, '❌ Network error: ' + err.message, 'error');
     tbody.innerHTML = '<tr><td colspan="6" class="empty">Network error</td></tr>';
@@ -1,48 +1,463 @@
+import logging
+import math
 import os
+import time
 import uuid
 import requests
 import csv
-from PIL import Image as PILImage
-from io import BytesIO
+from celery.exceptions import Retry
 from app import celery, db
 from app.models import Product, Image
 from app.config import Config
+from app.utils.db_utils import dialect_insert
+from app.utils.image_cache import (
+    ImageStore, content_hash, forget_outputs, load_image_sources, save_image_sources, url_hash
+)
+from app.utils.host_guard import HostGuard
+from app.utils.image_utils import (
+    RENDITION_FORMATS, HostDeferred, ImageRejected, conditional_request_headers, fetch_image_guarded, fetch_images,
+    parse_renditions, render_renditions, rendition_variant
+)
+from app.utils.job_utils import TaskProgress, increment_job, complete_job_if_finished
+from app.metrics import IMAGE_BYTES_DOWNLOADED, IMAGE_RENDER_DURATION, IMAGE_STAGE_DURATION, IMAGES_PROCESSED
+from app.utils.response_cache import invalidate_products
+
+logger = logging.getLogger(__name__)
+
+# Failure reasons caused by safety limits rather than errors
+REJECTION_REASONS = ('too_large', 'too_many_pixels', 'over_memory_budget', 'out_of_memory')
+
+# Outputs are shared on disk between workers; URL validators live in the image_sources table
+image_store = ImageStore(
+    Config.IMAGE_OUTPUT_DIR,
+    max_bytes=Config.IMAGE_CACHE_MAX_BYTES,
+    evict_interval=Config.IMAGE_CACHE_EVICT_INTERVAL,
+    staging_max_age=Config.IMAGE_STAGING_MAX_AGE,
+    on_evict=lambda root, keys: invalidate_products(forget_outputs(root, keys))
+)
+
+# Slow or failing hosts are throttled and deferred without holding back downloads from other hosts
+host_guard = HostGuard(
+    Config.IMAGE_HOST_STATE_PATH,
+    rate=Config.IMAGE_HOST_RATE_LIMIT,
+    burst=Config.IMAGE_HOST_BURST,
+    failure_threshold=Config.IMAGE_HOST_FAILURE_THRESHOLD,
+    open_seconds=Config.IMAGE_HOST_OPEN_SECONDS
+)
+
+# Processing is split in two stages routed to separate queues (see app/__init__.py):
+# the fetch stage downloads and stages raw bytes, the transform stage decodes,
+# resizes and records them. Downloads deferred by host_guard are retried by
+# re-running the fetch task for just those URLs, carrying the manifest so far.
+
+@celery.task(bind=True, max_retries=Config.IMAGE_HOST_DEFER_MAX_RETRIES)
+def process_images_task(self, product_id, image_urls, renditions=None, manifest=None):
+    """Fetch stage for a single product; the task's result is that of transform_images_task"""
+    if manifest is None and not Product.query.get(product_id):
+        self.update_state(state='FAILURE', meta={'error': 'Product not found'})
+        return {"error": "Product not found"}
+
+    progress = _start_progress(self, 'fetch', len(manifest['deferred']) if manifest else len(image_urls))
+    manifest = _fetch_product_images(
+        progress, product_id, image_urls, renditions, previous=manifest, can_defer=_can_defer(self)
+    )
+    if manifest['deferred']:
+        raise self.retry(
+            args=(product_id, image_urls, renditions), kwargs={'manifest': manifest}, countdown=manifest['retry_after']
+        )
+    if self.request.called_directly:
+        return _transform_product(self, manifest)
+    raise self.replace(transform_images_task.s(manifest))
+
 
 @celery.task(bind=True)
-def process_images_task(self, product_id, image_urls):
-    product = Product.query.get(product_id)
+def transform_images_task(self, manifest):
+    """Transform stage for a single product fetched by process_images_task"""
+    return _transform_product(self, manifest)
+
+
+@celery.task(bind=True, max_retries=Config.IMAGE_HOST_DEFER_MAX_RETRIES)
+def process_product_batch_task(self, job_id, items, renditions=None, manifests=None):
+    """Fetch stage for a batch of [product_id, image_urls] rows belonging to an upload job"""
+    try:
+        return _fetch_product_batch(self, job_id, items, renditions, manifests)
+    except Retry:
+        raise
+    except Exception as e:
+        _fail_batch(job_id, sum(len(image_urls) for _, image_urls in items), e)
+        raise
+
+
+@celery.task(bind=True)
+def transform_product_batch_task(self, job_id, manifests):
+    """Transform stage for a batch fetched by process_product_batch_task"""
+    try:
+        return _transform_product_batch(self, job_id, manifests)
+    except Exception as e:
+        _fail_batch(job_id, sum(len(manifest['image_urls']) for manifest in manifests), e)
+        raise
+
+
+def _fetch_product_batch(task, job_id, items, renditions, manifests):
+    can_defer = _can_defer(task)
+    if manifests is None:
+        manifests = []
+        progress = _start_progress(task, 'fetch', sum(len(image_urls) for _, image_urls in items))
+        for product_id, image_urls in items:
+            if not Product.query.get(product_id):
+                progress.advance(failures=[
+                    {'input_image_url': url, 'reason': 'product_not_found', 'error': 'Product not found'}
+                    for url in image_urls
+                ])
+                # Nothing to download; the transform stage counts these images as failed
+                manifests.append(_empty_manifest(product_id, image_urls, renditions))
+                continue
+            manifests.append(
+                _fetch_product_images(progress, product_id, image_urls, renditions, can_defer=can_defer)
+            )
+    else:
+        progress = _start_progress(task, 'fetch', sum(len(manifest['deferred']) for manifest in manifests))
+        manifests = [
+            _fetch_product_images(
+                progress, manifest['product_id'], manifest['image_urls'], renditions,
+                previous=manifest, can_defer=can_defer
+            ) if manifest['deferred'] else manifest
+            for manifest in manifests
+        ]
+
+    deferred = [manifest for manifest in manifests if manifest['deferred']]
+    if deferred:
+        raise task.retry(
+            args=(job_id, items, renditions),
+            kwargs={'manifests': manifests},
+            countdown=max(manifest['retry_after'] for manifest in deferred)
+        )
+    if task.request.called_directly:
+        return _transform_product_batch(task, job_id, manifests)
+    transform_product_batch_task.delay(job_id, manifests)
+    return {'job_id': job_id, 'products': len(manifests)}
+
+
+def _fail_batch(job_id, images_total, error):
+    """
+    Record a batch that failed as a whole (database errors, a failed CSV
+    write, ...) as completed with every image failed, so its job can still
+    finish instead of waiting on the batch forever.
+    """
+    logger.error(f"Batch for job {job_id} failed: {error}")
+    db.session.rollback()
+    try:
+        increment_job(job_id, completed_batches=1, images_failed=images_total)
+        complete_job_if_finished(job_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Could not record failed batch for job {job_id}: {e}")
+
+
+def _can_defer(task):
+    # Direct calls cannot be retried, and the last retry records deferred downloads as failures instead
+    return not task.request.called_directly and task.request.retries < task.max_retries
+
+
+def _empty_manifest(product_id, image_urls, renditions):
+    return {
+        'product_id': product_id,
+        'image_urls': image_urls,
+        'renditions': renditions,
+        'downloads': [],
+        'failed_images': [],
+        'deferred': [],
+        'retry_after': 0,
+    }
+
+
+def _start_progress(task, stage, images_total):
+    progress = TaskProgress(task, stage, images_total, interval=Config.TASK_PROGRESS_INTERVAL)
+    progress.publish()
+    return progress
+
+
+def _transform_product(task, manifest):
+    progress = _start_progress(task, 'transform', len(manifest['image_urls']))
+    image_rows, source_updates = [], {}
+    result = _transform_product_images(progress, manifest, image_rows, source_updates)
+    _save_results(image_rows, source_updates)
+    db.session.commit()
+    invalidate_products([manifest['product_id']])
+    return result
+
+
+def _transform_product_batch(task, job_id, manifests):
+    """Transform every product in a batch, then record images, validators and job progress in one transaction"""
+    results = []
+    image_rows, source_updates = [], {}
+    counters = {'images_done': 0, 'images_failed': 0, 'images_rejected': 0}
+    progress = _start_progress(task, 'transform', sum(len(manifest['image_urls']) for manifest in manifests))
+    for manifest in manifests:
+        result = _transform_product_images(progress, manifest, image_rows, source_updates)
+        results.append(result)
+        if 'error' in result:
+            counters['images_failed'] += len(manifest['image_urls'])
+            continue
+
+        images_done = len(result['output_image_urls'])
+        counters['images_done'] += images_done
+        counters['images_failed'] += len(manifest['image_urls']) - images_done
+        counters['images_rejected'] += sum(
+            1 for failure in result['failed_images'] if failure['reason'] in REJECTION_REASONS
+        )
+
+    _save_results(image_rows, source_updates)
+    increment_job(job_id, completed_batches=1, **counters)
+    complete_job_if_finished(job_id)
+    db.session.commit()
+    invalidate_products(manifest['product_id'] for manifest in manifests)
+    return results
+
+
+def _save_results(image_rows, source_updates):
+    """
+    Write processed images and URL validators with one statement each.
+    Images upsert on (product_id, url_hash), so a redelivered task overwrites
+    its earlier rows instead of duplicating them.
+    The caller is responsible for committing.
+    """
+    if image_rows:
+        # A URL repeated within a product would hit the same conflict target twice in one statement
+        rows = list({
+            (row['product_id'], row['input_image_url']): dict(row, url_hash=url_hash(row['input_image_url']))
+            for row in image_rows
+        }.values())
+        insert = dialect_insert()
+        stmt = insert(Image).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Image.product_id, Image.url_hash],
+            set_={column: stmt.excluded[column] for column in ('output_image_url', 'renditions')}
+        )
+        db.session.execute(stmt)
+    save_image_sources(source_updates)
+
+
+def _load_renditions(spec):
+    # Every rendition is produced from one decode; the first is the primary output
+    return parse_renditions(spec or Config.IMAGE_RENDITIONS, default_quality=Config.IMAGE_JPEG_QUALITY)
+
+
+def _rendition_paths(renditions, key):
+    return {
+        r.name: image_store.path_for(key, rendition_variant(r, Config.IMAGE_RESAMPLE), RENDITION_FORMATS[r.format])
+        for r in renditions
+    }
+
+
+def _record_failure(progress, failed_images, image_url, reason, error):
+    failure = {'input_image_url': image_url, 'reason': reason, 'error': str(error)}
+    failed_images.append(failure)
+    progress.advance(failures=[failure])
+    IMAGES_PROCESSED.labels(stage=progress.stage, outcome='failed').inc()
+
+
+def _fetch_product_images(progress, product_id, image_urls, renditions=None, previous=None, can_defer=False):
+    """
+    Download every image for a product, revalidating URLs we have seen before.
+    Raw bytes are staged on the shared image volume rather than passed through
+    the broker; images whose renditions are all stored already are not staged.
+    Args:
+        previous: Manifest from an earlier attempt; only its deferred URLs are fetched
+        can_defer: Whether throttled hosts are left in 'deferred' for a retry, or recorded as failures
+    Returns:
+        A JSON-serialisable manifest for _transform_product_images
+    """
+    started = time.monotonic()
+    parsed = _load_renditions(renditions)
+    pending = previous['deferred'] if previous else list(range(len(image_urls)))
+    pending_urls = [image_urls[index] for index in pending]
+
+    # Revalidate URLs we have already processed, as long as all their renditions are still stored
+    sources = load_image_sources(set(pending_urls))
+    conditional_headers = {
+        url: conditional_request_headers(source.etag, source.last_modified)
+        for url, source in sources.items()
+        if (source.etag or source.last_modified)
+        and all(os.path.exists(path) for path in _rendition_paths(parsed, source.content_hash).values())
+    }
+    downloads = list(previous['downloads']) if previous else []
+    # Images that could not be processed, with a machine-readable reason
+    failed_images = list(previous['failed_images']) if previous else []
+    # Positions of downloads refused by host_guard, and how long until their hosts accept requests again
+    deferred = []
+    retry_after = 0
+
+    # Every in-flight download may buffer up to IMAGE_MAX_DOWNLOAD_BYTES, so cap
+    # concurrency to what fits in this slot's memory budget
+    fetch_workers = max(1, min(
+        Config.IMAGE_FETCH_CONCURRENCY,
+        Config.IMAGE_MEMORY_BUDGET_BYTES // Config.IMAGE_MAX_DOWNLOAD_BYTES
+    ))
+
+    fetched_images = fetch_images(
+        pending_urls,
+        max_workers=fetch_workers,
+        per_host_limit=Config.IMAGE_FETCH_PER_HOST_CONCURRENCY,
+        timeout=Config.IMAGE_FETCH_TIMEOUT,
+        conditional_headers=conditional_headers,
+        max_bytes=Config.IMAGE_MAX_DOWNLOAD_BYTES,
+        host_guard=host_guard,
+        max_wait=Config.IMAGE_HOST_MAX_WAIT,
+    )
+
+    for position, image_url, fetched, error in fetched_images:
+        index = pending[position]
+        try:
+            if error is not None:
+                raise error
+
+            if fetched.not_modified:
+                # 304: skip download and resize, reuse the stored renditions
+                key = sources[image_url].content_hash
+                if all([image_store.touch(path) for path in _rendition_paths(parsed, key).values()]):
+                    downloads.append({'index': index, 'url': image_url, 'content_hash': key, 'revalidated': True})
+                    fetched = None
+                else:
+                    # A rendition was evicted after we revalidated; fetch it again in full, through the host guard
+                    fetched = fetch_image_guarded(
+                        image_url, host_guard, max_wait=Config.IMAGE_HOST_MAX_WAIT,
+                        timeout=Config.IMAGE_FETCH_TIMEOUT, max_bytes=Config.IMAGE_MAX_DOWNLOAD_BYTES
+                    )
+
+            if fetched is not None:
+                # Identical bytes (from any URL) are only decoded and resized once
+                key = content_hash(fetched.content)
+                stored = all([image_store.touch(path) for path in _rendition_paths(parsed, key).values()])
+                downloads.append({
+                    'index': index,
+                    'url': image_url,
+                    'content_hash': key,
+                    'revalidated': False,
+                    'staged_path': None if stored else image_store.stage(fetched.content),
+                    'etag': fetched.etag,
+                    'last_modified': fetched.last_modified,
+                    'content_length': fetched.content_length,
+                })
+
+        except HostDeferred as e:
+            if can_defer:
+                deferred.append(index)
+                retry_after = max(retry_after, e.retry_after)
+                IMAGES_PROCESSED.labels(stage='fetch', outcome='deferred').inc()
+            else:
+                _record_failure(progress, failed_images, image_url, 'host_unavailable', e)
+        except ImageRejected as e:
+            _record_failure(progress, failed_images, image_url, e.reason, e)
+        except requests.exceptions.RequestException as e:
+            _record_failure(progress, failed_images, image_url, 'download_failed',
+                            f'Failed to download image {image_url}: {e}')
+        except Exception as e:
+            _record_failure(progress, failed_images, image_url, 'processing_failed', e)
+        else:
+            bytes_downloaded = fetched.content_length if fetched else 0
+            progress.advance(done=1, bytes_downloaded=bytes_downloaded)
+            IMAGES_PROCESSED.labels(stage='fetch', outcome='ok').inc()
+            IMAGE_BYTES_DOWNLOADED.inc(bytes_downloaded or 0)
+
+    IMAGE_STAGE_DURATION.labels(stage='fetch').observe(time.monotonic() - started)
+    return {
+        'product_id': product_id,
+        'image_urls': image_urls,
+        'renditions': renditions,
+        'downloads': sorted(downloads, key=lambda download: download['index']),
+        'failed_images': failed_images,
+        'deferred': sorted(deferred),
+        'retry_after': math.ceil(retry_after),
+    }
+
+
+def _transform_product_images(progress, manifest, image_rows, source_updates):
+    """
+    Resize the images staged by _fetch_product_images and write the product's output CSV.
+    Image rows and URL validators are appended to image_rows/source_updates for
+    the caller to write with _save_results.
+    """
+    started = time.monotonic()
+    image_urls = manifest['image_urls']
+    product = Product.query.get(manifest['product_id'])
     if not product:
-        self.update_state(state='FAILURE', meta={'error': 'Product not found'})
+        for download in manifest['downloads']:
+            if download.get('staged_path'):
+                image_store.unstage(download['staged_path'])
+        progress.advance(failures=[
+            {'input_image_url': url, 'reason': 'product_not_found', 'error': 'Product not found'}
+            for url in image_urls
+        ])
         return {"error": "Product not found"}
 
-    output_image_urls = []
+    renditions = _load_renditions(manifest['renditions'])
+    failed_images = list(manifest['failed_images'])
+    progress.advance(failures=failed_images)
+
+    # Rendition paths indexed by input position so results stay in input order
+    # even though downloads complete out of order
+    outputs = [None] * len(image_urls)
 
-    for image_url in image_urls:
+    for download in manifest['downloads']:
+        image_url = download['url']
+        staged_path = download.get('staged_path')
         try:
-            response = requests.get(image_url, timeout=10)
-            response.raise_for_status()
-            image = PILImage.open(BytesIO(response.content))
+            key = download['content_hash']
+            paths = _rendition_paths(renditions, key)
 
-            output_image = image.resize((image.width // 2, image.height // 2))
+            missing = [r for r in renditions if not image_store.touch(paths[r.name])]
+            if missing:
+                if not staged_path:
+                    raise RuntimeError('Stored renditions were evicted before the image could be recorded')
+                with IMAGE_RENDER_DURATION.time():
+                    images = render_renditions(
+                        image_store.read_staged(staged_path),
+                        missing,
+                        resample=Config.IMAGE_RESAMPLE,
+                        reducing_gap=Config.IMAGE_REDUCING_GAP,
+                        max_pixels=Config.IMAGE_MAX_PIXELS,
+                        memory_budget=Config.IMAGE_MEMORY_BUDGET_BYTES
+                    )
+                    for r in missing:
+                        image_store.save(images[r.name], paths[r.name], format=r.format, quality=r.quality)
 
-            output_dir = Config.IMAGE_OUTPUT_DIR
-            os.makedirs(output_dir, exist_ok=True)
-            file_path = os.path.join(output_dir, f"{uuid.uuid4().hex}.jpg")
-            output_image.save(file_path)
+            if not download['revalidated']:
+                source_updates[image_url] = {
+                    'etag': download['etag'],
+                    'last_modified': download['last_modified'],
+                    'content_length': download['content_length'],
+                    'content_hash': key,
+                    'output_image_url': paths[renditions[0].name]
+                }
 
-            output_image_urls.append(file_path)
+            outputs[download['index']] = paths
 
-            image_entry = Image(product_id=product.id, input_image_url=image_url, output_image_url=file_path)
-            db.session.add(image_entry)
+            image_rows.append({
+                'product_id': product.id,
+                'input_image_url': image_url,
+                'output_image_url': paths[renditions[0].name],
+                'renditions': paths
+            })
 
-        except requests.exceptions.RequestException as e:
-            self.update_state(state='FAILURE', meta={'error': f'Failed to download image {image_url}: {e}'})
-            continue
+        except ImageRejected as e:
+            _record_failure(progress, failed_images, image_url, e.reason, e)
+        except MemoryError:
+            # Keep the worker child alive; the image's buffers are released once this frame unwinds
+            _record_failure(progress, failed_images, image_url, 'out_of_memory',
+                            'Ran out of memory while processing image')
         except Exception as e:
-            self.update_state(state='FAILURE', meta={'error': f'Failed to process image {image_url}: {e}'})
-            continue
+            _record_failure(progress, failed_images, image_url, 'processing_failed', e)
+        else:
+            progress.advance(done=1)
+            IMAGES_PROCESSED.labels(stage='transform', outcome='ok').inc()
+        finally:
+            if staged_path:
+                image_store.unstage(staged_path)
 
-    db.session.commit()
+    processed = [(url, paths) for url, paths in zip(image_urls, outputs) if paths is not None]
+    output_image_urls = [paths[renditions[0].name] for _, paths in processed]
 
     # Generate the output CSV
     output_csv_dir = Config.OUTPUT_CSV_DIR
@@ -52,13 +467,16 @@ def process_images_task(self, product_id, image_urls):
     with open(output_csv_path, 'w', newline='') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerow(['Serial Number', 'Product Name', 'Input Image Urls', 'Output Image Urls'])
-        for input_url, output_url in zip(image_urls, output_image_urls):
+        for (input_url, _), output_url in zip(processed, output_image_urls):
             csvwriter.writerow([product.serial_number, product.product_name, input_url, output_url])
 
+    IMAGE_STAGE_DURATION.labels(stage='transform').observe(time.monotonic() - started)
     return {
         'serial_number': product.serial_number,
         'product_name': product.product_name,
         'input_image_urls': image_urls,
         'output_image_urls': output_image_urls,
+        'output_renditions': [paths for _, paths in processed],
+        'failed_images': failed_images,
         'output_csv_path': output_csv_path  # Return the CSV file path
     }
@@ -0,0 +1,72 @@
+import csv
+import os
+from app import celery, db
+from app.models import UploadJob
+from app.config import Config
+from app.tasks.image_tasks import process_product_batch_task
+from app.utils.csv_utils import iter_chunks, parse_row, upload_path, upsert_products
+from app.utils.job_utils import increment_job, complete_job_if_finished
+from app.utils.response_cache import invalidate_products
+
+@celery.task(bind=True)
+def ingest_upload_task(self, job_id):
+    """Parse a persisted upload, upsert its products and enqueue image batches"""
+    job = db.session.get(UploadJob, job_id)
+    if not job:
+        return {"error": "Job not found"}
+
+    job.status = 'INGESTING'
+    db.session.commit()
+
+    file_path = upload_path(job_id)
+    try:
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+            csv_reader = csv.reader(f)
+            next(csv_reader, None)  # Header was validated by /upload
+
+            for chunk in iter_chunks(csv_reader, Config.CSV_INGEST_CHUNK_SIZE):
+                rows = [parse_row(row) for row in chunk]
+
+                # One lookup, one upsert and one commit per chunk
+                product_ids = upsert_products({serial_number: product_name for serial_number, product_name, _ in rows})
+
+                # Publish one broker message per batch of rows rather than per row
+                batches = list(iter_chunks(
+                    ([product_ids[serial_number], image_urls_list] for serial_number, _, image_urls_list in rows),
+                    Config.UPLOAD_BATCH_SIZE
+                ))
+                increment_job(
+                    job_id,
+                    total_rows=len(rows),
+                    total_images=sum(len(image_urls_list) for _, _, image_urls_list in rows),
+                    total_batches=len(batches)
+                )
+                db.session.commit()
+                # Upserts may have renamed existing products
+                invalidate_products(product_ids.values())
+
+                for batch in batches:
+                    process_product_batch_task.delay(job_id, batch, job.renditions)
+    except csv.Error:
+        return _fail_job(job, "Error reading CSV file")
+    except Exception as e:
+        return _fail_job(job, str(e))
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    job.status = 'QUEUED'
+    db.session.commit()
+    complete_job_if_finished(job_id)
+    db.session.commit()
+    db.session.refresh(job)
+    return job.to_dict()
+
+
+def _fail_job(job, error):
+    """Record an ingestion failure on the upload job"""
+    db.session.rollback()
+    job.status = 'FAILED'
+    job.error = error
+    db.session.commit()
+    return job.to_dict()
@@ -0,0 +1,88 @@
+"""Helpers for streaming CSV ingestion"""
+import os
+import re
+from itertools import islice
+
+from app import db
+from app.config import Config
+from app.models import Product
+from app.utils.csv_validator import REQUIRED_COLUMNS, URL_REGEX
+from app.utils.db_utils import dialect_insert
+
+
+def upload_path(job_id):
+    """Location of the raw CSV persisted for an upload job"""
+    return os.path.join(Config.UPLOAD_FOLDER, f"{job_id}.csv")
+
+
+def is_valid_url(url):
+    return re.match(URL_REGEX, url) is not None
+
+
+def parse_row(row):
+    """
+    Validate a single CSV data row.
+    Returns:
+        (serial_number, product_name, image_urls_list)
+    Raises:
+        ValueError with a client-facing message if the row is malformed
+    """
+    if len(row) != len(REQUIRED_COLUMNS):
+        raise ValueError("CSV format is incorrect. Each row should have 3 columns.")
+
+    serial_number, product_name, image_urls = row
+
+    image_urls_list = [url.strip() for url in image_urls.split(',')]
+    invalid_urls = [url for url in image_urls_list if not is_valid_url(url)]
+    if invalid_urls:
+        raise ValueError(f"Invalid image URLs found: {', '.join(invalid_urls)}")
+
+    return serial_number, product_name, image_urls_list
+
+
+def iter_chunks(rows, chunk_size):
+    """Yield lists of at most chunk_size items from an iterator without materialising it"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def upsert_products(products):
+    """
+    Resolve product IDs for a chunk of CSV rows, creating or renaming products as needed.
+    Args:
+        products: Dict mapping serial_number to product_name
+    Returns:
+        Dict mapping serial_number to product ID
+    """
+    if not products:
+        return {}
+
+    # One batched lookup for the whole chunk
+    existing = db.session.query(Product.id, Product.serial_number, Product.product_name).filter(
+        Product.serial_number.in_(list(products))
+    )
+    product_ids = {}
+    for product_id, serial_number, product_name in existing:
+        if products[serial_number] == product_name:
+            product_ids[serial_number] = product_id
+
+    pending = [
+        {'serial_number': serial_number, 'product_name': product_name}
+        for serial_number, product_name in products.items()
+        if serial_number not in product_ids
+    ]
+    if pending:
+        insert = dialect_insert()
+        stmt = insert(Product).values(pending)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Product.serial_number],
+            set_={'product_name': stmt.excluded.product_name},
+        ).returning(Product.id, Product.serial_number)
+        for product_id, serial_number in db.session.execute(stmt):
+            product_ids[serial_number] = product_id
+
+    return product_ids
@@ -0,0 +1,44 @@
+"""Database helpers shared across ingestion and image processing"""
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+from app import db
+from app.metrics import TimedQueuePool
+
+
+def dialect_insert():
+    """Return the dialect-specific insert() that supports ON CONFLICT"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert
+    # SQLite is used by the test suite and supports the same ON CONFLICT syntax
+    return sqlite.insert
+
+
+def engine_options(config):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings.
+    Pool sizing only applies to PostgreSQL. With DB_PGBOUNCER set, PgBouncer
+    (transaction pooling) owns the pooling: connections are not kept open
+    here, and no startup parameters are sent, since PgBouncer rejects them.
+    psycopg2 never uses server-side prepared statements, so those need no
+    special handling.
+    """
+    if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() != 'postgresql':
+        return {}
+
+    if config['DB_PGBOUNCER']:
+        # statement_timeout has to come from the role (ALTER ROLE ... SET statement_timeout)
+        return {'poolclass': NullPool}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': bool(config['DB_POOL_PRE_PING']),
+    }
+    if config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
@@ -0,0 +1,164 @@
+"""Background sampling of dependency health for the health routes"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import psutil
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """
+    Samples the database, Celery workers and system resources every interval
+    seconds on a daemon thread, so health endpoints only read the last snapshot.
+
+    The first use in a process samples synchronously, so no caller ever sees a
+    status before real checks have run, then starts the thread. Starting on
+    first use rather than at import keeps the thread out of gunicorn's master
+    and restarts it in any process forked after it started.
+    Readiness uses db_ping(), which shares one SELECT 1 between all probes
+    arriving within ready_ttl seconds.
+    """
+
+    def __init__(self, app, interval=15, celery_timeout=2, ready_ttl=5):
+        self.app = app
+        self.interval = interval
+        self.celery_timeout = celery_timeout
+        self.ready_ttl = ready_ttl
+        self._snapshot = None
+        self._ping = None  # (checked_at, error or None)
+        self._ping_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread_pid = None
+        # The first non-blocking reading only sets the baseline for the next one
+        psutil.cpu_percent(interval=None)
+
+    def start(self):
+        """Start the sampler thread for this process if it is not running"""
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._start_lock:
+            if self._thread_pid == pid:
+                return
+            thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+            thread.start()
+            self._thread_pid = pid
+
+    def snapshot(self):
+        """
+        Return the last sampled health, with its age in seconds.
+        If the sampler has missed several intervals the status becomes 'stale'.
+        """
+        if self._snapshot is None:
+            with self._refresh_lock:
+                # Concurrent first callers share one synchronous sample
+                if self._snapshot is None:
+                    self.refresh()
+        self.start()
+        snapshot = self._snapshot
+
+        age = time.time() - snapshot['sampled_at']
+        result = dict(snapshot, age_seconds=round(age, 3))
+        if age > 3 * self.interval + self.celery_timeout:
+            result['status'] = 'stale'
+        return result
+
+    def refresh(self):
+        """Run every check now and replace the snapshot"""
+        checks = {
+            'database': self._check_database(),
+            'celery': self._check_celery(),
+            'system': self._check_system(),
+        }
+        unhealthy = any(check.get('status') == 'unhealthy' for check in checks.values())
+        sampled_at = time.time()
+        self._snapshot = {
+            'status': 'unhealthy' if unhealthy else 'healthy',
+            'sampled_at': sampled_at,
+            'timestamp': datetime.utcfromtimestamp(sampled_at).isoformat(),
+            'checks': checks,
+        }
+
+    def db_ping(self):
+        """
+        Return None if the database answered within the last ready_ttl seconds,
+        otherwise the error from the most recent ping.
+        """
+        ping = self._ping
+        if ping and time.monotonic() - ping[0] < self.ready_ttl:
+            return ping[1]
+        with self._ping_lock:
+            # Probes that queued behind another ping reuse its result
+            ping = self._ping
+            if ping and time.monotonic() - ping[0] < self.ready_ttl:
+                return ping[1]
+            return self._run_ping()
+
+    def _run_ping(self):
+        from app import db
+
+        try:
+            db.session.execute(db.text('SELECT 1'))
+            error = None
+        except Exception as e:
+            error = str(e)
+        finally:
+            db.session.remove()
+        self._ping = (time.monotonic(), error)
+        return error
+
+    def _check_database(self):
+        with self._ping_lock:
+            error = self._run_ping()
+        if error:
+            return {'status': 'unhealthy', 'error': error}
+        return {'status': 'healthy'}
+
+    def _check_celery(self):
+        from app import celery
+
+        try:
+            replies = celery.control.inspect(timeout=self.celery_timeout).ping()
+        except Exception as e:
+            return {'status': 'unhealthy', 'error': str(e)}
+        if not replies:
+            return {'status': 'degraded', 'message': 'No workers responded'}
+        return {'status': 'healthy', 'workers': len(replies)}
+
+    def _check_system(self):
+        return {
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'memory_percent': psutil.virtual_memory().percent,
+            'disk_percent': psutil.disk_usage('/').percent
+        }
+
+    def _run(self):
+        while True:
+            # A sample was just taken by the first caller (or before fork)
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.refresh()
+            except Exception:
+                logger.exception('Health sampling failed')
+
+
+def init_health_monitor(app):
+    """Attach the health monitor to the app; its thread starts on first use"""
+    config = app.config
+    app.extensions['health_monitor'] = HealthMonitor(
+        app,
+        interval=config['HEALTH_SAMPLE_INTERVAL'],
+        celery_timeout=config['HEALTH_CELERY_TIMEOUT'],
+        ready_ttl=config['HEALTH_READY_TTL']
+    )
+
+
+def get_health_monitor():
+    return current_app.extensions['health_monitor']
@@ -0,0 +1,112 @@
+"""Per-host token bucket and circuit breaker for outbound image downloads"""
+import sqlite3
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS host_state (
+    host TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    refilled_at REAL NOT NULL,
+    failures INTEGER NOT NULL DEFAULT 0,
+    open_until REAL NOT NULL DEFAULT 0
+)
+"""
+
+
+class HostGuard:
+    """
+    Throttles and circuit-breaks downloads per host, with state kept in a
+    SQLite file so every worker process on the node shares one budget.
+
+    Each host gets a token bucket refilled at rate requests/second up to burst.
+    After failure_threshold consecutive failures (timeouts, connection errors,
+    5xx/429) the breaker opens and the host is refused for open_seconds. The
+    next request after that is admitted as the only trial: the breaker stays
+    shut to everyone else until the trial's success closes it, its failure
+    re-opens it, or another open_seconds pass without a result.
+
+    The guard fails open: if the state file cannot be used, downloads proceed.
+    """
+
+    def __init__(self, path, rate=20.0, burst=40, failure_threshold=5, open_seconds=60):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._initialised = False
+
+    def _connect(self):
+        # One short-lived connection per call keeps the guard safe across threads, greenlets and forks
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        if not self._initialised:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(_SCHEMA)
+            self._initialised = True
+        return conn
+
+    def acquire(self, host):
+        """
+        Take a token for host.
+        Returns:
+            0 if the request may go ahead, otherwise the number of seconds to wait
+        """
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute(
+                    'SELECT tokens, refilled_at, failures, open_until FROM host_state WHERE host = ?', (host,)
+                ).fetchone()
+                tokens, refilled_at, failures, open_until = row if row else (self.burst, now, 0, 0)
+
+                if open_until > now:
+                    conn.execute('ROLLBACK')
+                    return open_until - now
+
+                if self.rate:
+                    tokens = min(self.burst, tokens + (now - refilled_at) * self.rate)
+                    if tokens < 1:
+                        conn.execute('ROLLBACK')
+                        return (1 - tokens) / self.rate
+                    tokens -= 1
+
+                if failures >= self.failure_threshold:
+                    # Half-open: this request is the trial, everyone else waits for its outcome
+                    open_until = now + self.open_seconds
+
+                conn.execute(
+                    'INSERT INTO host_state (host, tokens, refilled_at, open_until) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (host) DO UPDATE SET tokens = excluded.tokens, refilled_at = excluded.refilled_at, '
+                    'open_until = excluded.open_until',
+                    (host, tokens, now, open_until)
+                )
+                conn.execute('COMMIT')
+                return 0
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return 0
+
+    def record_success(self, host):
+        """Close the breaker for host"""
+        self._execute('UPDATE host_state SET failures = 0, open_until = 0 WHERE host = ? AND failures > 0', (host,))
+
+    def record_failure(self, host):
+        """Count a failed request, opening the breaker once failure_threshold is reached"""
+        self._execute(
+            'UPDATE host_state SET failures = failures + 1, '
+            'open_until = CASE WHEN failures + 1 >= ? THEN ? ELSE open_until END WHERE host = ?',
+            (self.failure_threshold, time.time() + self.open_seconds, host)
+        )
+
+    def _execute(self, sql, params):
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(sql, params)
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
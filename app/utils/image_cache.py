@@ -0,0 +1,208 @@
+"""Content-addressed storage for processed images and per-URL revalidation data"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from app import db
+from app.models import Image, ImageSource
+from app.utils.db_utils import dialect_insert
+
+
+def content_hash(content):
+    """SHA-256 of downloaded bytes, used as the storage key"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def url_hash(url):
+    """SHA-256 of an input URL, used as the image_sources key"""
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def load_image_sources(urls):
+    """Fetch stored validators for many URLs in one query. Returns dict url -> ImageSource."""
+    hashes = {url_hash(url): url for url in urls}
+    if not hashes:
+        return {}
+    sources = ImageSource.query.filter(ImageSource.url_hash.in_(list(hashes)))
+    return {hashes[source.url_hash]: source for source in sources}
+
+
+def save_image_sources(sources):
+    """
+    Upsert validators for freshly downloaded URLs in a single statement.
+    Args:
+        sources: Dict of url -> dict with etag, last_modified, content_length, content_hash, output_image_url
+    The caller is responsible for committing.
+    """
+    if not sources:
+        return
+    now = datetime.utcnow()
+    rows = [
+        dict(values, url_hash=url_hash(url), input_image_url=url, checked_at=now)
+        for url, values in sources.items()
+    ]
+    insert = dialect_insert()
+    stmt = insert(ImageSource).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ImageSource.url_hash],
+        set_={
+            column: stmt.excluded[column]
+            for column in ('etag', 'last_modified', 'content_length', 'content_hash', 'output_image_url', 'checked_at')
+        }
+    )
+    db.session.execute(stmt)
+
+
+def forget_outputs(root, keys):
+    """
+    Record that every output stored under keys was evicted: image rows pointing at
+    them lose output_image_url and renditions, and the validators of their source
+    URLs are dropped so the next upload downloads and renders them again.
+    Runs in its own transaction. Returns the affected product IDs.
+    """
+    keys = list(keys)
+    if not keys:
+        return set()
+    prefixes = [os.path.join(root, f"{key}_") for key in keys]
+    referencing = db.or_(*[Image.output_image_url.startswith(prefix, autoescape=True) for prefix in prefixes])
+    with db.engine.begin() as conn:
+        product_ids = set(conn.scalars(db.select(Image.product_id).where(referencing).distinct()))
+        conn.execute(db.update(Image).where(referencing).values(output_image_url=None, renditions=None))
+        conn.execute(db.delete(ImageSource).where(ImageSource.content_hash.in_(keys)))
+    return product_ids
+
+
+class ImageStore:
+    """
+    Stores processed images under a name derived from the source content hash,
+    so identical inputs map to a single output file. With max_bytes set, the
+    renditions of an input are evicted together, least recently used first, once
+    the directory grows past it, and on_evict is called with the evicted keys.
+    Raw downloads handed from the fetch stage to the transform stage are kept
+    in a staging subdirectory; any left unclaimed past staging_max_age are swept.
+    """
+
+    def __init__(self, root, max_bytes=0, evict_interval=300, staging_max_age=86400, on_evict=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.evict_interval = evict_interval
+        self.staging_max_age = staging_max_age
+        self.staging_dir = os.path.join(root, 'staging')
+        self._last_evicted = 0.0
+        self._lock = threading.Lock()
+
+    def path_for(self, key, variant, extension='.jpg'):
+        return os.path.join(self.root, f"{key}_{variant}{extension}")
+
+    def touch(self, path):
+        """Mark a stored file as recently used. Returns False if it no longer exists."""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def save(self, image, path, **save_kwargs):
+        """Write an image atomically so concurrent workers never see a partial file"""
+        os.makedirs(self.root, exist_ok=True)
+        root, extension = os.path.splitext(path)
+        tmp_path = f"{root}.{uuid.uuid4().hex}.tmp{extension}"
+        try:
+            image.save(tmp_path, **save_kwargs)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.maybe_evict()
+
+    def stage(self, content):
+        """Write downloaded bytes where a transform worker can read them. Returns the staged path."""
+        os.makedirs(self.staging_dir, exist_ok=True)
+        path = os.path.join(self.staging_dir, f"{uuid.uuid4().hex}.bin")
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read_staged(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def unstage(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def maybe_evict(self):
+        """Run eviction at most once per evict_interval seconds in this process"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_evicted < self.evict_interval:
+                return
+            self._last_evicted = now
+        self.sweep_staging()
+        if self.max_bytes:
+            self.evict()
+
+    def sweep_staging(self):
+        """Delete staged downloads whose transform never ran"""
+        cutoff = time.time() - self.staging_max_age
+        removed = 0
+        try:
+            with os.scandir(self.staging_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        self.unstage(entry.path)
+                        removed += 1
+        except FileNotFoundError:
+            pass
+        return removed
+
+    def evict(self):
+        """
+        Delete the least recently used keys, with all their renditions, until the
+        store is back under 90% of max_bytes. Returns the number of files removed.
+        """
+        groups = {}  # key -> [last_used, size, paths]
+        total = 0
+        try:
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    # Skip in-flight atomic writes
+                    if not entry.is_file() or '.tmp.' in entry.name:
+                        continue
+                    stat = entry.stat()
+                    group = groups.setdefault(entry.name.split('_', 1)[0], [0.0, 0, []])
+                    group[0] = max(group[0], stat.st_mtime)
+                    group[1] += stat.st_size
+                    group[2].append(entry.path)
+                    total += stat.st_size
+        except FileNotFoundError:
+            return 0
+
+        if total <= self.max_bytes:
+            return 0
+
+        target = int(self.max_bytes * 0.9)
+        evicted = []
+        removed = 0
+        for key, (_, size, paths) in sorted(groups.items(), key=lambda item: item[1][0]):
+            if total <= target:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            evicted.append(key)
+            total -= size
+            removed += len(paths)
+
+        if evicted and self.on_evict:
+            self.on_evict(self.root, evicted)
+        return removed
+
@@ -0,0 +1,372 @@
+"""Helpers for downloading and resizing product images"""
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BytesIO
+from urllib.parse import urlsplit
+
+import requests
+from PIL import Image as PILImage
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.config import Config
+
+# Bytes read per iteration when streaming a download
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class ImageRejected(Exception):
+    """Raised when an image is refused by a safety limit rather than failing unexpectedly"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class HostDeferred(Exception):
+    """Raised when a host is throttled or its circuit breaker is open, so the download should be retried later"""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f'{host} is throttled; retry in {retry_after:.1f}s')
+        self.host = host
+        self.retry_after = retry_after
+
+
+# Outcome of a single download; content is None when the server answered 304 Not Modified
+FetchResult = namedtuple('FetchResult', ['content', 'not_modified', 'etag', 'last_modified', 'content_length'])
+
+# Pooled sessions per worker process, plain and guarded; rebuilt after fork so
+# children never share sockets with their parent
+_http_sessions = {}
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def build_http_session(guarded=False):
+    """
+    Create a requests session with connection pooling and retry/backoff from Config.
+    Guarded sessions (used with a HostGuard) do not retry read timeouts or
+    error statuses, so one slow request costs one timeout and every failure
+    reaches the circuit breaker.
+    """
+    retry = Retry(
+        total=Config.IMAGE_HTTP_RETRIES,
+        read=0 if guarded else None,
+        status=0 if guarded else None,
+        backoff_factor=Config.IMAGE_HTTP_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=Config.IMAGE_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=Config.IMAGE_HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_http_session(guarded=False):
+    """Return the shared keep-alive session for the current process"""
+    global _http_session_pid
+    pid = os.getpid()
+    session = _http_sessions.get(guarded) if _http_session_pid == pid else None
+    if session is None:
+        with _http_session_lock:
+            if _http_session_pid != pid:
+                _http_sessions.clear()
+                _http_session_pid = pid
+            session = _http_sessions.get(guarded)
+            if session is None:
+                session = _http_sessions[guarded] = build_http_session(guarded)
+    return session
+
+
+def fetch_images(image_urls, max_workers=8, per_host_limit=4, timeout=10, session=None, conditional_headers=None,
+                 max_bytes=None, host_guard=None, max_wait=2.0):
+    """
+    Download images concurrently.
+    Args:
+        image_urls: List of image URLs to download
+        max_workers: Maximum number of downloads in flight for this call
+        per_host_limit: Maximum number of concurrent downloads against a single host
+        timeout: Per-request timeout in seconds
+        session: Object exposing a requests-compatible get(); defaults to the shared pooled session
+        conditional_headers: Optional dict of url -> If-None-Match/If-Modified-Since headers
+        max_bytes: Optional cap on the size of each download (see fetch_image)
+        host_guard: Optional HostGuard consulted before and updated after every request
+        max_wait: Longest the guard may delay a download in place; longer waits raise HostDeferred
+    Yields:
+        (index, url, result, error) tuples in completion order, where index is the
+        position of url in image_urls and exactly one of result (a FetchResult)/error is set
+    """
+    http = session or get_http_session(guarded=host_guard is not None)
+    conditional_headers = conditional_headers or {}
+    host_slots = {}
+    host_slots_lock = threading.Lock()
+
+    def host_slot(host):
+        with host_slots_lock:
+            if host not in host_slots:
+                host_slots[host] = threading.BoundedSemaphore(per_host_limit)
+            return host_slots[host]
+
+    def download(url):
+        with host_slot(urlsplit(url).netloc.lower()):
+            if host_guard is None:
+                return fetch_image(
+                    url, timeout=timeout, session=http, headers=conditional_headers.get(url), max_bytes=max_bytes
+                )
+            return fetch_image_guarded(
+                url, host_guard, max_wait=max_wait, timeout=timeout, session=http,
+                headers=conditional_headers.get(url), max_bytes=max_bytes
+            )
+
+    if not image_urls:
+        return
+
+    workers = max(1, min(max_workers, len(image_urls)))
+    pending = enumerate(image_urls)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Only max_workers downloads are submitted at a time, and each future is
+        # dropped once yielded, so at most that many bodies are held in memory
+        futures = {}
+
+        def submit_next():
+            for index, url in pending:
+                futures[executor.submit(download, url)] = (index, url)
+                return
+
+        for _ in range(workers):
+            submit_next()
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            while done:
+                future = done.pop()
+                index, url = futures.pop(future)
+                try:
+                    outcome = (index, url, future.result(), None)
+                except Exception as e:
+                    outcome = (index, url, None, e)
+                del future
+                yield outcome
+                outcome = None
+                submit_next()
+
+
+def fetch_image_guarded(url, host_guard, max_wait=2.0, timeout=10, session=None, headers=None, max_bytes=None):
+    """
+    Download a single image once host_guard admits its host, and report the
+    outcome back to the guard. The guarded session does not retry on its own,
+    since the guard decides when a failing host is tried again.
+    Raises:
+        HostDeferred if the host will not accept requests within max_wait seconds
+    """
+    host = urlsplit(url).netloc.lower()
+    while True:
+        wait = host_guard.acquire(host)
+        if not wait:
+            break
+        if wait > max_wait:
+            raise HostDeferred(host, wait)
+        time.sleep(wait)
+
+    try:
+        result = fetch_image(
+            url, timeout=timeout, session=session or get_http_session(guarded=True), headers=headers,
+            max_bytes=max_bytes
+        )
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        host_guard.record_failure(host)
+        raise
+    except requests.exceptions.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status is None or status == 429 or status >= 500:
+            host_guard.record_failure(host)
+        raise
+    host_guard.record_success(host)
+    return result
+
+
+def fetch_image(url, timeout=10, session=None, headers=None, max_bytes=None):
+    """
+    Download a single image, optionally as a conditional request.
+    The body is streamed and abandoned as soon as it exceeds max_bytes, so an
+    oversize response never has to fit in memory.
+    Returns:
+        A FetchResult
+    Raises:
+        ImageRejected('too_large') if the body is larger than max_bytes
+    """
+    http = session or get_http_session()
+    response = http.get(url, timeout=timeout, headers=headers, stream=True)
+    try:
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code == 304:
+            return FetchResult(None, True, etag, last_modified, None)
+        response.raise_for_status()
+
+        declared = response.headers.get('Content-Length')
+        if max_bytes and declared and declared.isdigit() and int(declared) > max_bytes:
+            raise ImageRejected('too_large', f'Content-Length {declared} exceeds the {max_bytes} byte limit')
+
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise ImageRejected('too_large', f'Download exceeds the {max_bytes} byte limit')
+            chunks.append(chunk)
+        content = b''.join(chunks)
+        return FetchResult(content, False, etag, last_modified, len(content))
+    finally:
+        response.close()
+
+
+def conditional_request_headers(etag, last_modified):
+    """Build revalidation headers from previously seen validators"""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+RESAMPLING_FILTERS = {
+    'nearest': PILImage.Resampling.NEAREST,
+    'box': PILImage.Resampling.BOX,
+    'bilinear': PILImage.Resampling.BILINEAR,
+    'hamming': PILImage.Resampling.HAMMING,
+    'bicubic': PILImage.Resampling.BICUBIC,
+    'lanczos': PILImage.Resampling.LANCZOS,
+}
+
+
+# Output formats we can write, with the extension used for stored files
+RENDITION_FORMATS = {
+    'JPEG': '.jpg',
+    'WEBP': '.webp',
+    'PNG': '.png',
+    'AVIF': '.avif',
+}
+
+# One output size/format produced from a source image. Exactly one of scale
+# (divide source dimensions) or max_size (fit within a square box) is set.
+Rendition = namedtuple('Rendition', ['name', 'scale', 'max_size', 'format', 'quality'])
+
+
+def parse_renditions(spec, default_quality=85):
+    """
+    Validate a rendition spec such as
+        [{"name": "thumb", "max_size": 128, "format": "WEBP", "quality": 80},
+         {"name": "half", "scale": 2, "format": "JPEG"}]
+    The first rendition is the primary output recorded as output_image_url.
+    Raises:
+        ValueError with a client-facing message if the spec is invalid
+    """
+    if not isinstance(spec, list) or not spec:
+        raise ValueError('renditions must be a non-empty list')
+
+    renditions = []
+    for item in spec:
+        if not isinstance(item, dict) or not item.get('name'):
+            raise ValueError('each rendition needs a name')
+        name = str(item['name'])
+        if not name.replace('-', '').replace('_', '').isalnum():
+            raise ValueError(f"rendition name '{name}' may only contain letters, digits, '-' and '_'")
+        if name in {r.name for r in renditions}:
+            raise ValueError(f"duplicate rendition name '{name}'")
+
+        scale, max_size = item.get('scale'), item.get('max_size')
+        if (scale is None) == (max_size is None):
+            raise ValueError(f"rendition '{name}' needs exactly one of scale or max_size")
+        for value in (scale, max_size):
+            if value is not None and (not isinstance(value, int) or value < 1):
+                raise ValueError(f"rendition '{name}' scale/max_size must be a positive integer")
+
+        image_format = str(item.get('format', 'JPEG')).upper()
+        PILImage.init()  # AVIF additionally needs a plugin such as pillow-avif-plugin to be imported
+        if image_format not in RENDITION_FORMATS or image_format not in PILImage.SAVE:
+            raise ValueError(f"rendition '{name}' format {image_format} is not supported")
+
+        quality = item.get('quality', default_quality)
+        if not isinstance(quality, int) or not 1 <= quality <= 100:
+            raise ValueError(f"rendition '{name}' quality must be between 1 and 100")
+
+        renditions.append(Rendition(name, scale, max_size, image_format, quality))
+    return renditions
+
+
+def rendition_variant(rendition, resample):
+    """Storage suffix for a rendition; any parameter change yields a new file"""
+    size = f"s{rendition.scale}" if rendition.scale else f"m{rendition.max_size}"
+    return f"{rendition.name}-{size}-{resample}-q{rendition.quality}"
+
+
+def rendition_size(rendition, width, height):
+    """Target size for a rendition of a width x height source, never upscaling"""
+    if rendition.scale:
+        return max(1, width // rendition.scale), max(1, height // rendition.scale)
+    ratio = min(1.0, rendition.max_size / max(width, height))
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def render_renditions(content, renditions, resample='lanczos', reducing_gap=3.0, max_pixels=None, memory_budget=None):
+    """
+    Produce every rendition from a single decode of the source bytes.
+    JPEGs are decoded in draft mode, letting libjpeg's DCT scaling decode
+    straight at the smallest scale that still covers the largest rendition.
+    Each rendition is then resized from that one decoded image; resize() with
+    reducing_gap applies Image.reduce() first for large reductions.
+    Dimensions are checked against max_pixels and memory_budget from the header
+    alone, before any pixel data is decoded.
+    Returns:
+        Dict of rendition name -> RGB (or L) PIL image
+    Raises:
+        ImageRejected('too_many_pixels' or 'over_memory_budget')
+    """
+    try:
+        image = PILImage.open(BytesIO(content))
+    except PILImage.DecompressionBombError as e:
+        raise ImageRejected('too_many_pixels', str(e))
+
+    if max_pixels and image.width * image.height > max_pixels:
+        raise ImageRejected(
+            'too_many_pixels', f'{image.width}x{image.height} exceeds the {max_pixels} pixel limit'
+        )
+
+    targets = {r.name: rendition_size(r, image.width, image.height) for r in renditions}
+    largest = max(targets.values(), key=lambda size: size[0] * size[1])
+
+    if image.format == 'JPEG':
+        # Picks the largest DCT scale (1/2, 1/4, 1/8) that stays >= the largest target
+        image.draft('RGB', largest)
+
+    if memory_budget:
+        # Decoded bitmap plus every output, at up to 4 bytes per pixel
+        decoded = image.width * image.height
+        needed = 4 * (decoded + sum(w * h for w, h in targets.values()))
+        if needed > memory_budget:
+            raise ImageRejected(
+                'over_memory_budget', f'Decoding needs ~{needed} bytes, over the {memory_budget} byte budget'
+            )
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    outputs = {}
+    for name, target in targets.items():
+        if image.size == target:
+            outputs[name] = image
+        else:
+            outputs[name] = image.resize(target, resample=RESAMPLING_FILTERS[resample], reducing_gap=reducing_gap)
+    return outputs
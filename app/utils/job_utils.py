@@ -0,0 +1,86 @@
+"""Helpers for tracking upload job and task progress"""
+import time
+from collections import deque
+from datetime import datetime
+
+from app import db
+from app.models import UploadJob
+
+
+def increment_job(job_id, **counters):
+    """
+    Atomically add to upload job counters, e.g. increment_job(job_id, images_done=3).
+    Uses UPDATE ... SET col = col + n so concurrent workers never lose updates.
+    The caller is responsible for committing.
+    """
+    values = {name: getattr(UploadJob, name) + amount for name, amount in counters.items() if amount}
+    if values:
+        db.session.execute(db.update(UploadJob).where(UploadJob.id == job_id).values(**values))
+
+
+def complete_job_if_finished(job_id):
+    """Mark a fully enqueued job as completed once every batch has reported back"""
+    db.session.execute(
+        db.update(UploadJob)
+        .where(
+            UploadJob.id == job_id,
+            UploadJob.status == 'QUEUED',
+            UploadJob.completed_batches >= UploadJob.total_batches
+        )
+        .values(status='COMPLETED', completed_at=datetime.utcnow())
+    )
+
+
+class TaskProgress:
+    """
+    Publishes a running task's progress as Celery PROGRESS state meta.
+    Updates are throttled to one result-backend write per interval, so callers
+    can report after every image without loading the backend.
+    """
+
+    # Failures carried in the meta, newest last
+    RECENT_FAILURES = 20
+
+    def __init__(self, task, stage, images_total, interval=1.0):
+        self.task = task
+        self.stage = stage
+        self.images_total = images_total
+        self.interval = interval
+        self.images_done = 0
+        self.images_failed = 0
+        self.bytes_downloaded = 0
+        self.recent_failures = deque(maxlen=self.RECENT_FAILURES)
+        self.started = time.monotonic()
+        self._last_published = None
+
+    def advance(self, done=0, bytes_downloaded=0, failures=()):
+        """Record finished images; failures is a list of failed_images entries"""
+        self.images_done += done
+        self.bytes_downloaded += bytes_downloaded
+        self.images_failed += len(failures)
+        self.recent_failures.extend(failures)
+        self.publish()
+
+    def publish(self, force=False):
+        # Tasks called directly (not through a worker) have no state to update
+        if not self.task.request.id:
+            return
+        now = time.monotonic()
+        if not force and self._last_published is not None and now - self._last_published < self.interval:
+            return
+        self._last_published = now
+        self.task.update_state(state='PROGRESS', meta=self.to_dict())
+
+    def to_dict(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            'stage': self.stage,
+            'images_total': self.images_total,
+            'images_done': self.images_done,
+            'images_failed': self.images_failed,
+            'bytes_downloaded': self.bytes_downloaded,
+            'elapsed_seconds': round(elapsed, 3),
+            'images_per_second': round(self.images_done / elapsed, 2),
+            'bytes_per_second': round(self.bytes_downloaded / elapsed),
+            'recent_failures': list(self.recent_failures),
+        }
@@ -0,0 +1,104 @@
+"""Queue-based JSON logging, so request threads never wait on log I/O"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Attributes every LogRecord has; anything else was passed through extra= and is emitted as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including fields passed through extra="""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the background listener without blocking.
+    When the queue is full the record is dropped and counted rather than
+    stalling the caller.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Render the message and traceback here, where args and exc_info are
+        # still valid, but keep them separate for the JSON formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_listener = None
+
+
+def configure_logging(logger, log_file='app.log', max_bytes=10485760, backup_count=5, queue_size=10000,
+                      level=logging.INFO):
+    """
+    Route logger's records through a bounded queue to a background thread that
+    writes JSON lines to log_file ('-' for stdout), rotating at max_bytes.
+    Safe to call more than once per process; only the first call takes effect.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if log_file == '-':
+        target = logging.StreamHandler(sys.stdout)
+    else:
+        target = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    target.setFormatter(JsonFormatter())
+
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    _listener = QueueListener(handler.queue, target, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
+
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+    def restart_in_child():
+        # The writer thread does not survive fork; give the child a fresh queue and thread
+        handler.queue = _listener.queue = queue.Queue(queue_size)
+        _listener._thread = None
+        _listener.start()
+
+    os.register_at_fork(after_in_child=restart_in_child)
+
+
+def _stop_listener():
+    # Flush whatever is still queued before the process exits
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
@@ -0,0 +1,80 @@
+"""Helpers for keyset (cursor) pagination and cheap total counts"""
+import base64
+import binascii
+import json
+import threading
+import time
+
+from app import db
+from app.config import Config
+
+# Exact counts keyed by (table, filter) -> (expires_at, total)
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+_COUNT_CACHE_MAX_ENTRIES = 256
+
+
+def encode_cursor(last_id):
+    """Encode the last id of a page as an opaque cursor"""
+    payload = json.dumps({'id': last_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor.
+    Returns 0 for an empty cursor (first page).
+    Raises:
+        ValueError if the cursor is malformed
+    """
+    if not cursor:
+        return 0
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        return int(json.loads(payload)['id'])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValueError('Invalid cursor')
+
+
+def keyset_page(query, id_column, cursor, per_page):
+    """
+    Fetch one page ordered by id_column, starting after the cursor position.
+    Uses WHERE id > :last ORDER BY id LIMIT n+1 so no OFFSET scan or COUNT is needed.
+    Returns:
+        (rows, has_next)
+    """
+    last_id = decode_cursor(cursor)
+    rows = query.filter(id_column > last_id).order_by(None).order_by(id_column).limit(per_page + 1).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+def total_count(query, table_name, filter_key=None):
+    """
+    Total for a cursor-paginated listing.
+    Unfiltered PostgreSQL tables use the planner's row estimate from pg_class;
+    anything else runs an exact COUNT that is cached for PAGINATION_COUNT_CACHE_TTL seconds.
+    Returns:
+        (total, is_estimate)
+    """
+    if filter_key is None and db.engine.dialect.name == 'postgresql':
+        estimate = db.session.execute(
+            db.text('SELECT reltuples::bigint FROM pg_class WHERE relname = :table'),
+            {'table': table_name}
+        ).scalar()
+        # reltuples is -1 until the table has been analyzed
+        if estimate is not None and estimate >= 0:
+            return int(estimate), True
+
+    key = (table_name, filter_key)
+    now = time.monotonic()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1], False
+
+    total = query.order_by(None).count()
+    with _count_cache_lock:
+        if len(_count_cache) >= _COUNT_CACHE_MAX_ENTRIES:
+            _count_cache.clear()
+        _count_cache[key] = (now + Config.PAGINATION_COUNT_CACHE_TTL, total)
+    return total, False
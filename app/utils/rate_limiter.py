@@ -0,0 +1,128 @@
+"""Sliding-window rate limiter backends used by middleware.rate_limit"""
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Sliding-window counter in Redis: the previous window's count is weighted by how
+# much of it still overlaps the sliding window. Runs atomically on the server.
+_REDIS_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local elapsed = tonumber(ARGV[3])
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if previous * (window - elapsed) / window + current >= limit then
+    return {0, previous, current}
+end
+current = redis.call('INCR', KEYS[1])
+if current == 1 then
+    redis.call('EXPIRE', KEYS[1], math.ceil(window * 2))
+end
+return {1, previous, current}
+"""
+
+
+def _window(now, window_seconds):
+    """Index of the fixed window containing now, and seconds elapsed within it"""
+    index = int(now // window_seconds)
+    return index, now - index * window_seconds
+
+
+def _retry_after(previous, current, limit, window_seconds, elapsed):
+    """Seconds until the weighted count falls below limit again"""
+    remaining = window_seconds - elapsed
+    if current < limit and previous:
+        # The previous window's weight decays linearly over the rest of this window
+        remaining -= (limit - current) * window_seconds / previous
+    return max(1, math.ceil(remaining))
+
+
+class MemoryRateLimiter:
+    """
+    Per-process sliding-window limiter. Each key keeps two counters, so memory
+    is bounded by the number of clients active in the last two windows; idle
+    keys are swept at most once per sweep_interval seconds.
+    """
+
+    def __init__(self, sweep_interval=60):
+        self._counters = {}  # key -> [window_index, previous_count, current_count, expires_at]
+        self._lock = threading.Lock()
+        self._sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+
+    def hit(self, key, limit, window_seconds):
+        """
+        Count a request for key.
+        Returns:
+            (allowed, retry_after) where retry_after is in seconds when not allowed
+        """
+        now = time.time()
+        index, elapsed = _window(now, window_seconds)
+        # Once two windows have passed without a hit the counts carry no weight any more
+        expires_at = (index + 2) * window_seconds
+        with self._lock:
+            self._maybe_sweep(now)
+            counter = self._counters.get(key)
+            if counter is None or counter[0] < index - 1:
+                counter = self._counters[key] = [index, 0, 0, expires_at]
+            elif counter[0] == index - 1:
+                counter[:] = [index, counter[2], 0, expires_at]
+
+            _, previous, current, _ = counter
+            if previous * (window_seconds - elapsed) / window_seconds + current >= limit:
+                return False, _retry_after(previous, current, limit, window_seconds, elapsed)
+            counter[2] += 1
+            return True, 0
+
+    def _maybe_sweep(self, now):
+        monotonic = time.monotonic()
+        if monotonic - self._last_sweep < self._sweep_interval:
+            return
+        self._last_sweep = monotonic
+        # Each key expires on its own window, which may differ from the caller's
+        expired = [key for key, counter in self._counters.items() if counter[3] <= now]
+        for key in expired:
+            del self._counters[key]
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class RedisRateLimiter:
+    """
+    Sliding-window limiter shared by every process and pod through Redis.
+    Each hit is one atomic script call; window keys expire on their own.
+    If Redis is unreachable requests are allowed rather than rejected.
+    """
+
+    def __init__(self, url, prefix='ratelimit'):
+        import redis  # Only needed when RATE_LIMIT_STORAGE_URL points at Redis
+
+        self._redis_errors = redis.RedisError
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._script = self._client.register_script(_REDIS_SCRIPT)
+        self._prefix = prefix
+
+    def hit(self, key, limit, window_seconds):
+        index, elapsed = _window(time.time(), window_seconds)
+        keys = [f"{self._prefix}:{key}:{index}", f"{self._prefix}:{key}:{index - 1}"]
+        try:
+            allowed, previous, current = self._script(keys=keys, args=[limit, window_seconds, elapsed])
+        except self._redis_errors as e:
+            logger.warning(f"Rate limiter unavailable, allowing request: {e}")
+            return True, 0
+        if allowed:
+            return True, 0
+        return False, _retry_after(int(previous), int(current), limit, window_seconds, elapsed)
+
+
+def create_rate_limiter(storage_url):
+    """Build a limiter from a storage URL: memory:// or redis://host:port/db"""
+    if storage_url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisRateLimiter(storage_url)
+    if storage_url.startswith('memory://'):
+        return MemoryRateLimiter()
+    raise ValueError(f'Unsupported rate limit storage URL: {storage_url}')
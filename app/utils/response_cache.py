@@ -0,0 +1,171 @@
+"""Read-through cache for JSON responses, with strong ETags"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, make_response, request
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Two-tier cache of serialized response bodies.
+    The local tier is a per-process LRU whose entries expire after local_ttl;
+    the optional Redis tier is shared by every web process and pod, and is
+    where invalidations from other processes (including Celery workers) land.
+    Without Redis, local_ttl bounds how stale other processes can be.
+
+    Keys can embed a namespace generation (see generation/bump) so a whole
+    family of entries, such as every product listing, is invalidated at once.
+    """
+
+    def __init__(self, max_entries=1024, local_ttl=5, redis_url=None, redis_ttl=300, prefix='respcache'):
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+        self._entries = OrderedDict()  # key -> (expires_at, etag, body)
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            import redis  # Only needed when the Redis tier is configured
+
+            self._redis_errors = redis.RedisError
+            self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        """Return (etag, body) or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1], entry[2]
+
+        cached = self._redis_call('get', f"{self.prefix}:{key}")
+        if cached:
+            etag, body = json.loads(cached)
+            self._set_local(key, etag, body.encode('utf-8'))
+            return etag, body.encode('utf-8')
+        return None
+
+    def set(self, key, etag, body):
+        self._set_local(key, etag, body)
+        self._redis_call('setex', f"{self.prefix}:{key}", self.redis_ttl, json.dumps([etag, body.decode('utf-8')]))
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if keys:
+            self._redis_call('delete', *[f"{self.prefix}:{key}" for key in keys])
+
+    def generation(self, namespace):
+        """Current generation of namespace, to be embedded in its keys"""
+        shared = self._redis_call('get', f"{self.prefix}:gen:{namespace}")
+        if shared is not None:
+            return int(shared)
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        """Invalidate every key built from the current generation of namespace"""
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        self._redis_call('incr', f"{self.prefix}:gen:{namespace}")
+
+    def _set_local(self, key, etag, body):
+        if not self.local_ttl:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.local_ttl, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _redis_call(self, method, *args):
+        if self._redis is None:
+            return None
+        try:
+            return getattr(self._redis, method)(*args)
+        except self._redis_errors as e:
+            # The local tier keeps serving; entries just expire sooner
+            logger.warning(f"Response cache Redis tier unavailable: {e}")
+            return None
+
+
+def init_product_cache(app):
+    """Attach the product response cache to the app"""
+    config = app.config
+    app.extensions['product_cache'] = ResponseCache(
+        max_entries=config['PRODUCT_CACHE_MAX_ENTRIES'],
+        local_ttl=config['PRODUCT_CACHE_LOCAL_TTL'],
+        redis_url=config['PRODUCT_CACHE_REDIS_URL'],
+        redis_ttl=config['PRODUCT_CACHE_REDIS_TTL'],
+        prefix='products'
+    )
+
+
+def get_product_cache():
+    return current_app.extensions['product_cache']
+
+
+def product_key(product_id):
+    return f"product:{product_id}"
+
+
+def invalidate_products(product_ids=()):
+    """Drop cached product details for product_ids, and every cached product listing"""
+    cache = get_product_cache()
+    product_ids = set(product_ids)
+    if product_ids:
+        # Bumped before deleting so a detail read racing this write never stores its result (see cached_response)
+        cache.bump('product')
+        cache.delete(*[product_key(product_id) for product_id in product_ids])
+    cache.bump('list')
+
+
+def cached_response(key_func, namespace=None):
+    """
+    Serve a JSON view through the product cache.
+    key_func receives the view's arguments and returns the cache key. Only 200
+    responses are cached. Every response carries a strong ETag computed from
+    the body, and If-None-Match requests that match get an empty 304.
+
+    Keys that do not embed a generation can name the namespace their
+    invalidations bump: a body is only kept if that generation did not change
+    while the view ran, so a read that raced a write cannot cache stale data.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            cache = get_product_cache()
+            key = key_func(*args, **kwargs)
+            entry = cache.get(key)
+            if entry is None:
+                generation = cache.generation(namespace) if namespace else None
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                entry = (hashlib.sha256(body).hexdigest()[:32], body)
+                if generation is None or cache.generation(namespace) == generation:
+                    cache.set(key, *entry)
+                    # Checked again in case an invalidation landed between the check and the set
+                    if generation is not None and cache.generation(namespace) != generation:
+                        cache.delete(key)
+
+            etag, body = entry
+            response = Response(body, status=200, mimetype='application/json')
+            response.set_etag(etag)
+            # Clients may keep the body but must revalidate, which is cheap with If-None-Match
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapped
+    return decorator
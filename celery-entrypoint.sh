@@ -12,5 +12,10 @@ while ! nc -z rabbitmq 5672; do
 done
 echo "RabbitMQ started"
 
+# Processes of this container share one metrics directory; clear samples left by a previous run
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 echo "Starting Celery worker..."
 exec celery -A celery_worker.celery worker --loglevel=info
\ No newline at end of file
@@ -3,7 +3,21 @@
 Celery worker entry point.
 This file is used by the celery worker to load the Celery app and discover tasks.
 """
+from celery.signals import worker_process_init
+
 from app import create_app, celery, db
+from app.config import Config
+from app.metrics import init_celery_metrics
+
+try:
+    # Fetch workers run a gevent pool (already monkey-patched by the time this
+    # module loads); make psycopg2 yield to other greenlets on database waits
+    from gevent import monkey
+    if monkey.is_module_patched('socket'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+except ImportError:
+    pass
 
 
 flask_app = create_app()
@@ -19,8 +33,18 @@ class ContextTask(celery.Task):
 
 celery.Task = ContextTask
 
+init_celery_metrics(port=Config.CELERY_METRICS_PORT)
+
+
+@worker_process_init.connect
+def reset_db_pool(**kwargs):
+    # Prefork children inherit the parent's pooled connections; drop them
+    # without closing, so the parent's sockets are left alone
+    with flask_app.app_context():
+        db.engine.dispose(close=False)
+
 
-from app.tasks import image_tasks  # noqa: F401
+from app.tasks import image_tasks, upload_tasks  # noqa: F401
 
 if __name__ == '__main__':
     celery.start()
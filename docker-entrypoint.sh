@@ -36,5 +36,10 @@ EOF
 echo "Initializing database..."
 python init_db.py || echo "Database initialization skipped or failed (non-fatal)"
 
+# Processes of this container share one metrics directory; clear samples left by a previous run
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 echo "Starting Gunicorn..."
-exec gunicorn --workers 4 --bind 0.0.0.0:5000 --access-logfile - --error-logfile - wsgi:application
+exec gunicorn --config gunicorn.conf.py --workers 4 --bind 0.0.0.0:5000 --access-logfile - --error-logfile - wsgi:application
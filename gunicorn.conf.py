@@ -0,0 +1,14 @@
+"""Gunicorn settings and server hooks"""
+import os
+
+# Threaded workers, so job event streams (/jobs/<id>/events) and slow clients
+# each hold a thread rather than a whole worker process
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS') or 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS') or 16)
+
+
+def child_exit(server, worker):
+    # Drop live gauges of a dead worker so in-flight and pool gauges stay accurate
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
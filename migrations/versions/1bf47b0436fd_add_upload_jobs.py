@@ -0,0 +1,36 @@
+"""Add upload_jobs table for batched upload progress
+
+Revision ID: 1bf47b0436fd
+Revises: 1ed1cbcc3c56
+Create Date: 2026-10-16 09:12:41.503217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1bf47b0436fd'
+down_revision = '1ed1cbcc3c56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_jobs',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('total_rows', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('total_batches', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('completed_batches', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('images_done', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('images_failed', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('upload_jobs')
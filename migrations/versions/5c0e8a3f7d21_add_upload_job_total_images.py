@@ -0,0 +1,24 @@
+"""Add total_images to upload_jobs
+
+Revision ID: 5c0e8a3f7d21
+Revises: 1bf47b0436fd
+Create Date: 2026-10-16 10:03:17.220941
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0e8a3f7d21'
+down_revision = '1bf47b0436fd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('upload_jobs', sa.Column('total_images', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('upload_jobs', 'total_images')
@@ -0,0 +1,24 @@
+"""Index images.product_id for per-product image counts
+
+Revision ID: 8a4d2e91c6b3
+Revises: 5c0e8a3f7d21
+Create Date: 2026-10-16 11:26:54.108372
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4d2e91c6b3'
+down_revision = '5c0e8a3f7d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_images_product_id'), 'images', ['product_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_images_product_id'), table_name='images')
@@ -0,0 +1,34 @@
+"""Make images unique per (product_id, input_image_url)
+
+Revision ID: a7d3c5e19f40
+Revises: f1c6a9e27b48
+Create Date: 2026-10-16 15:42:08.517203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3c5e19f40'
+down_revision = 'f1c6a9e27b48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Drop duplicates left by retried tasks, keeping the earliest row
+    op.execute(
+        'DELETE FROM images WHERE id NOT IN '
+        '(SELECT MIN(id) FROM images GROUP BY product_id, input_image_url)'
+    )
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.create_unique_constraint('uq_images_product_id_input_image_url', ['product_id', 'input_image_url'])
+        # Covered by the unique constraint's leading column
+        batch_op.drop_index('ix_images_product_id')
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.create_index('ix_images_product_id', ['product_id'], unique=False)
+        batch_op.drop_constraint('uq_images_product_id_input_image_url', type_='unique')
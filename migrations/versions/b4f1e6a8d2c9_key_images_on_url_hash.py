@@ -0,0 +1,48 @@
+"""Key image uniqueness on a hash of input_image_url
+
+Revision ID: b4f1e6a8d2c9
+Revises: a7d3c5e19f40
+Create Date: 2026-10-16 18:27:41.093512
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4f1e6a8d2c9'
+down_revision = 'a7d3c5e19f40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('images', sa.Column('url_hash', sa.String(length=64), nullable=True))
+
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("UPDATE images SET url_hash = encode(sha256(convert_to(input_image_url, 'UTF8')), 'hex')")
+    else:
+        images = sa.table('images', sa.column('id', sa.Integer), sa.column('input_image_url', sa.Text),
+                          sa.column('url_hash', sa.String))
+        rows = bind.execute(sa.select(images.c.id, images.c.input_image_url)).all()
+        for image_id, url in rows:
+            bind.execute(
+                images.update().where(images.c.id == image_id)
+                .values(url_hash=hashlib.sha256(url.encode('utf-8')).hexdigest())
+            )
+
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.alter_column('url_hash', existing_type=sa.String(length=64), nullable=False)
+        # A btree entry on the raw URL fails for URLs longer than about 2.7 KB
+        batch_op.drop_constraint('uq_images_product_id_input_image_url', type_='unique')
+        batch_op.create_unique_constraint('uq_images_product_id_url_hash', ['product_id', 'url_hash'])
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_constraint('uq_images_product_id_url_hash', type_='unique')
+        batch_op.create_unique_constraint('uq_images_product_id_input_image_url', ['product_id', 'input_image_url'])
+        batch_op.drop_column('url_hash')
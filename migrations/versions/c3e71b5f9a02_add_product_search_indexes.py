@@ -0,0 +1,41 @@
+"""Add trigram and prefix search indexes on products
+
+Revision ID: c3e71b5f9a02
+Revises: 8a4d2e91c6b3
+Create Date: 2026-10-16 12:41:08.664190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e71b5f9a02'
+down_revision = '8a4d2e91c6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm and operator classes are PostgreSQL-only; SQLite (tests) falls back to table scans
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # GIN trigram indexes serve ILIKE '%term%' on both searchable columns
+    op.create_index('ix_products_serial_number_trgm', 'products', ['serial_number'],
+                    postgresql_using='gin', postgresql_ops={'serial_number': 'gin_trgm_ops'})
+    op.create_index('ix_products_product_name_trgm', 'products', ['product_name'],
+                    postgresql_using='gin', postgresql_ops={'product_name': 'gin_trgm_ops'})
+    # The unique index cannot serve LIKE 'term%' outside the C collation; pattern ops can
+    op.create_index('ix_products_serial_number_prefix', 'products', ['serial_number'],
+                    postgresql_ops={'serial_number': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_products_serial_number_prefix', table_name='products')
+    op.drop_index('ix_products_product_name_trgm', table_name='products')
+    op.drop_index('ix_products_serial_number_trgm', table_name='products')
@@ -0,0 +1,34 @@
+"""Add image_sources table for conditional image re-fetches
+
+Revision ID: d9b2f64a1e57
+Revises: c3e71b5f9a02
+Create Date: 2026-10-16 13:58:22.417036
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b2f64a1e57'
+down_revision = 'c3e71b5f9a02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image_sources',
+    sa.Column('url_hash', sa.String(length=64), nullable=False),
+    sa.Column('input_image_url', sa.Text(), nullable=False),
+    sa.Column('etag', sa.String(length=255), nullable=True),
+    sa.Column('last_modified', sa.String(length=64), nullable=True),
+    sa.Column('content_length', sa.BigInteger(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('output_image_url', sa.Text(), nullable=False),
+    sa.Column('checked_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('url_hash')
+    )
+
+
+def downgrade():
+    op.drop_table('image_sources')
@@ -0,0 +1,26 @@
+"""Add rendition columns to images and upload_jobs
+
+Revision ID: e4a8c0d3b716
+Revises: d9b2f64a1e57
+Create Date: 2026-10-16 15:10:45.932184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a8c0d3b716'
+down_revision = 'd9b2f64a1e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('images', sa.Column('renditions', sa.JSON(), nullable=True))
+    op.add_column('upload_jobs', sa.Column('renditions', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('upload_jobs', 'renditions')
+    op.drop_column('images', 'renditions')
@@ -0,0 +1,24 @@
+"""Add images_rejected to upload_jobs
+
+Revision ID: f1c6a9e27b48
+Revises: e4a8c0d3b716
+Create Date: 2026-10-16 16:02:39.581726
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c6a9e27b48'
+down_revision = 'e4a8c0d3b716'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('upload_jobs', sa.Column('images_rejected', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('upload_jobs', 'images_rejected')
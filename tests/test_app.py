@@ -1,5 +1,7 @@
 import pytest
 import os
+import sys
+import time
 from app import create_app
 from app.models import db, Product, Image
 
@@ -97,3 +99,1061 @@ def test_database_connection(app):
         # Try to query the database
         result = db.session.execute(db.text('SELECT 1')).fetchone()
         assert result[0] == 1
+
+
+def test_fetch_images_preserves_input_positions():
+    """Test that concurrent downloads report each result against its input index."""
+    from app.utils.image_utils import fetch_images
+
+    class FakeResponse:
+        status_code = 200
+        headers = {}
+
+        def __init__(self, url):
+            self.url = url
+            self.content = url.encode()
+
+        def raise_for_status(self):
+            if 'missing' in self.url:
+                raise RuntimeError('404')
+
+        def iter_content(self, chunk_size):
+            yield self.content
+
+        def close(self):
+            pass
+
+    class FakeSession:
+        def get(self, url, timeout=None, headers=None, stream=False):
+            return FakeResponse(url)
+
+    urls = ['http://a.example.com/1.jpg', 'http://b.example.com/missing.jpg', 'http://a.example.com/2.jpg']
+    results = {index: (fetched, error) for index, _, fetched, error in fetch_images(urls, session=FakeSession())}
+
+    assert results[0][0].content == urls[0].encode() and results[0][1] is None
+    assert results[1][0] is None and results[1][1] is not None
+    assert results[2][0].content == urls[2].encode() and results[2][1] is None
+
+
+def test_http_session_is_shared_per_process():
+    """Test that image downloads reuse one pooled session within a process."""
+    from app.utils.image_utils import get_http_session
+    from app.config import Config
+
+    session = get_http_session()
+    assert get_http_session() is session
+    adapter = session.get_adapter('https://cdn.example.com/image.jpg')
+    assert adapter._pool_maxsize == Config.IMAGE_HTTP_POOL_MAXSIZE
+    assert adapter.max_retries.total == Config.IMAGE_HTTP_RETRIES
+
+    # Downloads behind a host guard leave timeouts and error statuses to the circuit breaker
+    guarded = get_http_session(guarded=True)
+    assert guarded is not session and get_http_session(guarded=True) is guarded
+    retry = guarded.get_adapter('https://cdn.example.com/image.jpg').max_retries
+    assert (retry.read, retry.status) == (0, 0)
+
+
+def test_upload_csv_upserts_products(app, client, monkeypatch, tmp_path):
+    """Test that an accepted upload is ingested in the background with bulk product upserts."""
+    import io
+    import importlib
+    import json
+    upload_module = importlib.import_module('app.routes.upload_routes')
+    upload_tasks = importlib.import_module('app.tasks.upload_tasks')
+
+    ingest_requests = []
+    dispatched = []
+
+    class FakeIngestTask:
+        @staticmethod
+        def delay(job_id):
+            ingest_requests.append(job_id)
+
+    class FakeBatchTask:
+        @staticmethod
+        def delay(job_id, items, renditions=None):
+            dispatched.append((job_id, items, renditions))
+
+    monkeypatch.setattr(upload_module, 'ingest_upload_task', FakeIngestTask)
+    monkeypatch.setattr(upload_tasks, 'process_product_batch_task', FakeBatchTask)
+    monkeypatch.setattr(upload_tasks.Config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(upload_tasks.Config, 'CSV_INGEST_CHUNK_SIZE', 2)
+    monkeypatch.setattr(upload_tasks.Config, 'UPLOAD_BATCH_SIZE', 1)
+
+    with app.app_context():
+        db.session.add(Product(serial_number='SN1', product_name='Old Name'))
+        db.session.commit()
+
+        csv_body = (
+            'Serial Number,Product Name,Input Image Urls\n'
+            'SN1,New Name,"http://example.com/a.jpg, http://example.com/b.jpg"\n'
+            'SN2,Second,http://example.com/c.jpg\n'
+            'SN3,Third,http://example.com/d.jpg\n'
+        )
+        renditions = [{'name': 'thumb', 'max_size': 128, 'format': 'WEBP'}]
+        response = client.post(
+            '/upload',
+            data={'file': (io.BytesIO(csv_body.encode()), 'products.csv'), 'renditions': json.dumps(renditions)},
+            content_type='multipart/form-data',
+        )
+        assert response.status_code == 202
+        data = response.get_json()
+        assert data['status'] == 'PENDING'
+        assert ingest_requests == [data['job_id']]
+
+        result = upload_tasks.ingest_upload_task(data['job_id'])
+        assert result['status'] == 'QUEUED'
+        assert result['total_rows'] == 3
+        assert result['total_images'] == 4
+        assert result['total_batches'] == 3
+        assert not list(tmp_path.iterdir())
+
+        products = {p.serial_number: p for p in Product.query.all()}
+        assert products['SN1'].product_name == 'New Name'
+        assert set(products) == {'SN1', 'SN2', 'SN3'}
+        assert dispatched[0] == (
+            data['job_id'],
+            [[products['SN1'].id, ['http://example.com/a.jpg', 'http://example.com/b.jpg']]],
+            renditions
+        )
+
+        job_response = client.get(data['status_url'])
+        assert job_response.status_code == 200
+        assert job_response.get_json()['total_batches'] == 3
+
+        from app.utils.job_utils import increment_job, complete_job_if_finished
+        increment_job(data['job_id'], completed_batches=3, images_done=4)
+        complete_job_if_finished(data['job_id'])
+        db.session.commit()
+        job_data = client.get(data['status_url']).get_json()
+        assert job_data['status'] == 'COMPLETED'
+        assert job_data['images_done'] == 4
+
+
+def test_upload_csv_rejects_bad_header(client, monkeypatch, tmp_path):
+    """Test that header validation still happens synchronously on upload."""
+    import io
+    from app.config import Config
+
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', str(tmp_path))
+    response = client.post(
+        '/upload',
+        data={'file': (io.BytesIO(b'Serial,Name\n'), 'products.csv')},
+        content_type='multipart/form-data',
+    )
+    assert response.status_code == 400
+    assert not list(tmp_path.iterdir())
+
+
+def test_job_status_not_found(client):
+    """Test requesting an unknown upload job."""
+    response = client.get('/jobs/doesnotexist')
+    assert response.status_code == 404
+
+
+def test_fetch_task_states_uses_single_mget():
+    """Test that bulk status lookups read a key/value backend in one MGET."""
+    from celery import Celery
+    from app.routes.status_routes import _fetch_task_states
+
+    backend = Celery(backend='cache+memory://').backend
+    backend.store_result('task-done', {'ok': True}, 'SUCCESS')
+
+    calls = []
+    original_mget = backend.mget
+
+    def counting_mget(keys):
+        calls.append(keys)
+        return original_mget(keys)
+
+    backend.mget = counting_mget
+    states = _fetch_task_states(['task-done', 'task-unknown'], backend=backend)
+
+    assert len(calls) == 1
+    assert states['task-done'] == ('SUCCESS', {'ok': True})
+    assert states['task-unknown'] == ('PENDING', None)
+
+
+def test_bulk_status_and_job_events(app, client):
+    """Test bulk job lookup and the server-sent events stream for a finished job."""
+    from app.models import UploadJob
+
+    with app.app_context():
+        db.session.add(UploadJob(id='job1', status='COMPLETED', total_rows=2))
+        db.session.commit()
+
+    response = client.post('/status/bulk', json={'job_ids': ['job1', 'missing']})
+    assert response.status_code == 200
+    jobs = response.get_json()['jobs']
+    assert jobs[0]['status'] == 'COMPLETED'
+    assert jobs[1]['error'] == 'Job not found'
+
+    assert client.post('/status/bulk', json={}).status_code == 400
+
+    response = client.get('/jobs/job1/events')
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert '"total_rows": 2' in body
+    assert 'event: done' in body
+
+
+def test_job_events_stream_limit(app, client, monkeypatch):
+    """Test that streams beyond the per-worker limit are refused and finished streams free their slot."""
+    import importlib
+    import threading
+    from app.models import UploadJob
+    status_routes = importlib.import_module('app.routes.status_routes')
+
+    with app.app_context():
+        db.session.add(UploadJob(id='job-limit', status='COMPLETED', total_rows=1))
+        db.session.commit()
+
+    streams = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(status_routes, '_job_event_streams', streams)
+
+    streams.acquire()
+    response = client.get('/jobs/job-limit/events')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    streams.release()
+
+    response = client.get('/jobs/job-limit/events')
+    assert response.status_code == 200
+    assert 'event: done' in response.get_data(as_text=True)
+    response.close()
+    assert streams.acquire(blocking=False)
+
+
+def test_save_results_upserts_on_url_hash(app):
+    """Test that image rows are keyed on a hash of the URL, so redelivered results overwrite long URLs."""
+    import importlib
+    from app.utils.image_cache import url_hash
+    image_tasks = importlib.import_module('app.tasks.image_tasks')
+
+    long_url = 'http://example.com/' + 'a' * 4000 + '.jpg'
+    with app.app_context():
+        product = Product(serial_number='HASH1', product_name='Hashed')
+        db.session.add(product)
+        db.session.flush()
+        db.session.add(Image(product_id=product.id, input_image_url='http://example.com/orm.jpg'))
+        for output in ('/out/first.jpg', '/out/second.jpg'):
+            row = {'product_id': product.id, 'input_image_url': long_url, 'output_image_url': output,
+                   'renditions': None}
+            image_tasks._save_results([row, dict(row)], {})
+        db.session.commit()
+
+        images = {image.input_image_url: image for image in Image.query.filter_by(product_id=product.id)}
+        assert len(images) == 2
+        assert images[long_url].url_hash == url_hash(long_url)
+        assert images[long_url].output_image_url == '/out/second.jpg'
+        assert images['http://example.com/orm.jpg'].url_hash == url_hash('http://example.com/orm.jpg')
+
+
+def test_list_products_image_counts_single_query(app, client):
+    """Test that product image counts are computed without a query per product."""
+    from sqlalchemy import event
+
+    with app.app_context():
+        for i in range(3):
+            product = Product(serial_number=f'CNT{i}', product_name=f'Count {i}')
+            db.session.add(product)
+            db.session.flush()
+            for j in range(i):
+                db.session.add(Image(product_id=product.id, input_image_url=f'http://example.com/{i}/{j}.jpg'))
+        db.session.commit()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])  # noqa: E731
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = client.get('/api/products')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        counts = {p['serial_number']: p['image_count'] for p in response.get_json()['products']}
+        assert counts == {'CNT0': 0, 'CNT1': 1, 'CNT2': 2}
+        # One page query plus one total count, regardless of the number of products
+        assert len(statements) == 2
+
+
+def test_list_products_cursor_pagination(app, client):
+    """Test keyset pagination walks every product exactly once."""
+    with app.app_context():
+        for i in range(5):
+            db.session.add(Product(serial_number=f'CUR{i}', product_name=f'Cursor {i}'))
+        db.session.commit()
+
+    seen = []
+    cursor = ''
+    while True:
+        response = client.get(f'/api/products?per_page=2&include_total=true&cursor={cursor}')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['pagination']['total'] == 5
+        seen.extend(p['serial_number'] for p in data['products'])
+        if not data['pagination']['has_next']:
+            break
+        cursor = data['pagination']['next_cursor']
+
+    assert seen == [f'CUR{i}' for i in range(5)]
+    assert client.get('/api/products?cursor=not-a-cursor').status_code == 400
+
+
+def test_list_images_paginated_and_exported(app, client):
+    """Test that image listing is paginated by default and can be streamed as NDJSON."""
+    import json
+
+    with app.app_context():
+        product = Product(serial_number='IMG1', product_name='Image Product')
+        db.session.add(product)
+        db.session.flush()
+        for i in range(3):
+            db.session.add(Image(product_id=product.id, input_image_url=f'http://example.com/{i}.jpg'))
+        db.session.commit()
+
+    data = client.get('/api/products/images?per_page=2').get_json()
+    assert len(data['images']) == 2
+    assert data['images'][0]['serial_number'] == 'IMG1'
+    assert data['pagination']['has_next'] is True
+
+    response = client.get('/api/products/images?format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['input_image_url'] for line in lines] == [f'http://example.com/{i}.jpg' for i in range(3)]
+
+    exported = json.loads(client.get('/api/products/images?format=json').get_data(as_text=True))
+    assert len(exported) == 3
+
+
+def test_list_products_search_modes(app, client):
+    """Test substring and serial-number prefix search, with LIKE wildcards matched literally."""
+    with app.app_context():
+        db.session.add(Product(serial_number='ABC-100', product_name='Blue Widget'))
+        db.session.add(Product(serial_number='XABC-200', product_name='Red 50% Widget'))
+        db.session.commit()
+
+    def serials(query):
+        response = client.get(f'/api/products?{query}')
+        assert response.status_code == 200
+        return sorted(p['serial_number'] for p in response.get_json()['products'])
+
+    assert serials('search=ABC') == ['ABC-100', 'XABC-200']
+    assert serials('search=ABC&search_mode=prefix') == ['ABC-100']
+    assert serials('search=50%25') == ['XABC-200']
+    assert serials('search=_') == []
+    assert client.get('/api/products?search=a&search_mode=fuzzy').status_code == 400
+
+
+def _png_bytes(color, size=(8, 8)):
+    from io import BytesIO
+    from PIL import Image as PILImage
+
+    buffer = BytesIO()
+    PILImage.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class FakeImageServer:
+    """requests-compatible session serving fixed image bytes with ETags."""
+
+    def __init__(self, images):
+        self.images = images
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None, stream=False):
+        headers = headers or {}
+        self.requests.append((url, headers))
+        etag = f'"{url}"'
+        content = self.images[url]
+
+        class Response:
+            def raise_for_status(self):
+                pass
+
+            def iter_content(self, chunk_size):
+                for start in range(0, len(self.content), chunk_size):
+                    yield self.content[start:start + chunk_size]
+
+            def close(self):
+                pass
+
+        response = Response()
+        response.headers = {'ETag': etag}
+        response.status_code = 304 if headers.get('If-None-Match') == etag else 200
+        response.content = b'' if response.status_code == 304 else content
+        return response
+
+
+def test_process_images_dedups_and_revalidates(app, monkeypatch, tmp_path):
+    """Test that identical images share one output and repeat URLs are revalidated with ETags."""
+    from app.tasks import image_tasks
+    from app.utils import image_utils
+    from app.utils.image_cache import ImageStore
+
+    red = _png_bytes('red')
+    server = FakeImageServer({'http://a.example.com/1.png': red, 'http://b.example.com/copy.png': red})
+    monkeypatch.setattr(image_utils, 'get_http_session', lambda guarded=False: server)
+    monkeypatch.setattr(image_tasks, 'image_store', ImageStore(str(tmp_path / 'images')))
+    monkeypatch.setattr(image_tasks.Config, 'OUTPUT_CSV_DIR', str(tmp_path / 'csv'))
+
+    with app.app_context():
+        product = Product(serial_number='DEDUP1', product_name='Dedup')
+        db.session.add(product)
+        db.session.commit()
+
+        urls = list(server.images)
+        renditions = [{'name': 'half', 'scale': 2}, {'name': 'thumb', 'max_size': 4, 'format': 'WEBP'}]
+        first = image_tasks.process_images_task(product.id, urls, renditions)
+        assert len(set(first['output_image_urls'])) == 1
+        assert first['output_renditions'][0]['thumb'].endswith('.webp')
+        assert len([path for path in (tmp_path / 'images').iterdir() if path.is_file()]) == 2
+        assert not list((tmp_path / 'images' / 'staging').iterdir())
+        assert Image.query.first().renditions == first['output_renditions'][0]
+
+        server.requests.clear()
+        second = image_tasks.process_images_task(product.id, urls, renditions)
+        assert second['output_image_urls'] == first['output_image_urls']
+        assert all(headers.get('If-None-Match') for _, headers in server.requests)
+        # Reprocessing the same URLs upserts rather than duplicating rows
+        assert Image.query.filter_by(product_id=product.id).count() == len(urls)
+
+        from app.models import ImageSource
+        source = ImageSource.query.filter_by(input_image_url=urls[0]).one()
+        assert source.etag == f'"{urls[0]}"'
+        assert source.content_length == len(red)
+        assert source.output_image_url == first['output_image_urls'][0]
+
+
+def test_image_store_evicts_least_recently_used(tmp_path):
+    """Test that the image store trims the oldest files once it exceeds its size cap."""
+    import os
+    from app.utils.image_cache import ImageStore
+
+    store = ImageStore(str(tmp_path), max_bytes=250)
+    for i, name in enumerate(['old', 'mid', 'new']):
+        path = tmp_path / name
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (1000 + i, 1000 + i))
+
+    assert store.evict() == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['mid', 'new']
+
+
+def test_image_store_eviction_clears_image_rows(app, tmp_path):
+    """Test that evicting an image drops all its renditions, its output URLs and its source validators."""
+    import os
+    from app.models import ImageSource
+    from app.utils.image_cache import ImageStore, forget_outputs, url_hash
+
+    old_key, new_key = 'a' * 64, 'b' * 64
+    store = ImageStore(str(tmp_path), max_bytes=250, on_evict=forget_outputs)
+    for i, name in enumerate([f'{old_key}_half.jpg', f'{old_key}_thumb.webp', f'{new_key}_half.jpg']):
+        path = tmp_path / name
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (1000 + i, 1000 + i))
+
+    with app.app_context():
+        product = Product(serial_number='EVICT1', product_name='Evicted')
+        db.session.add(product)
+        db.session.flush()
+        for key, url in ((old_key, 'http://example.com/old.jpg'), (new_key, 'http://example.com/new.jpg')):
+            output = store.path_for(key, 'half')
+            db.session.add(Image(product_id=product.id, input_image_url=url, output_image_url=output,
+                                 renditions={'half': output}))
+            db.session.add(ImageSource(url_hash=url_hash(url), input_image_url=url, content_hash=key,
+                                       output_image_url=output))
+        db.session.commit()
+
+        assert store.evict() == 2
+        assert sorted(p.name for p in tmp_path.iterdir()) == [f'{new_key}_half.jpg']
+
+        images = {image.input_image_url: image for image in Image.query.all()}
+        assert images['http://example.com/old.jpg'].output_image_url is None
+        assert images['http://example.com/old.jpg'].renditions is None
+        assert images['http://example.com/new.jpg'].output_image_url == store.path_for(new_key, 'half')
+        assert [source.content_hash for source in ImageSource.query.all()] == [new_key]
+
+
+def test_render_renditions_from_single_decode():
+    """Test that every rendition is produced from one decode, with JPEGs decoded in draft mode."""
+    from io import BytesIO
+    from PIL import Image as PILImage
+    from app.utils.image_utils import parse_renditions, render_renditions
+
+    renditions = parse_renditions([
+        {'name': 'half', 'scale': 2, 'format': 'JPEG'},
+        {'name': 'thumb', 'max_size': 16, 'format': 'WEBP', 'quality': 70},
+    ])
+
+    buffer = BytesIO()
+    PILImage.new('RGB', (64, 48), 'blue').save(buffer, format='JPEG')
+    outputs = render_renditions(buffer.getvalue(), renditions)
+    assert outputs['half'].size == (32, 24)
+    assert outputs['thumb'].size == (16, 12)
+
+    buffer = BytesIO()
+    PILImage.new('RGBA', (10, 7), (0, 255, 0, 128)).save(buffer, format='PNG')
+    png = render_renditions(buffer.getvalue(), renditions[:1], resample='bicubic')['half']
+    assert png.size == (5, 3)
+    assert png.mode == 'RGB'
+
+    for bad in ([], [{'name': 'x', 'scale': 2, 'max_size': 5}], [{'name': 'x', 'scale': 2, 'format': 'BMP9'}]):
+        with pytest.raises(ValueError):
+            parse_renditions(bad)
+
+
+def test_process_images_rejects_oversize_inputs(app, monkeypatch, tmp_path):
+    """Test that byte and pixel limits reject images with a distinct reason instead of failing the task."""
+    from app.tasks import image_tasks
+    from app.utils import image_utils
+    from app.utils.image_cache import ImageStore
+
+    server = FakeImageServer({
+        'http://a.example.com/ok.png': _png_bytes('red', (4, 4)),
+        'http://a.example.com/wide.png': _png_bytes('red', (40, 2)),
+        'http://a.example.com/heavy.png': bytes(5000),
+    })
+    monkeypatch.setattr(image_utils, 'get_http_session', lambda guarded=False: server)
+    monkeypatch.setattr(image_tasks, 'image_store', ImageStore(str(tmp_path / 'images')))
+    monkeypatch.setattr(image_tasks.Config, 'OUTPUT_CSV_DIR', str(tmp_path / 'csv'))
+    monkeypatch.setattr(image_tasks.Config, 'IMAGE_MAX_DOWNLOAD_BYTES', 1000)
+    monkeypatch.setattr(image_tasks.Config, 'IMAGE_MAX_PIXELS', 50)
+
+    with app.app_context():
+        product = Product(serial_number='LIMIT1', product_name='Limits')
+        db.session.add(product)
+        db.session.commit()
+
+        result = image_tasks.process_images_task(product.id, list(server.images))
+        assert len(result['output_image_urls']) == 1
+        reasons = {f['input_image_url']: f['reason'] for f in result['failed_images']}
+        assert reasons == {
+            'http://a.example.com/wide.png': 'too_many_pixels',
+            'http://a.example.com/heavy.png': 'too_large',
+        }
+
+
+def test_fetch_stage_stages_bytes_for_transform_queue(app, monkeypatch, tmp_path):
+    """Test that batches are fetched on the fetch queue and handed to the transform queue via staged files."""
+    from app import celery
+    from app.tasks import image_tasks
+    from app.utils import image_utils
+    from app.utils.image_cache import ImageStore
+    from app.utils.job_utils import TaskProgress
+
+    route = celery.amqp.router.route
+    assert route({}, image_tasks.process_product_batch_task.name)['queue'].name == 'image_fetch'
+    assert route({}, image_tasks.transform_product_batch_task.name)['queue'].name == 'image_transform'
+
+    server = FakeImageServer({'http://a.example.com/1.png': _png_bytes('red')})
+    monkeypatch.setattr(image_utils, 'get_http_session', lambda guarded=False: server)
+    monkeypatch.setattr(image_tasks, 'image_store', ImageStore(str(tmp_path / 'images')))
+    monkeypatch.setattr(image_tasks.Config, 'OUTPUT_CSV_DIR', str(tmp_path / 'csv'))
+
+    with app.app_context():
+        product = Product(serial_number='STAGE1', product_name='Stage')
+        db.session.add(product)
+        db.session.commit()
+
+        progress = TaskProgress(image_tasks.process_images_task, 'fetch', 1)
+        manifest = image_tasks._fetch_product_images(progress, product.id, list(server.images))
+        staged_path = manifest['downloads'][0]['staged_path']
+        assert os.path.exists(staged_path)
+        assert Image.query.count() == 0
+
+        result = image_tasks.transform_images_task(manifest)
+        assert len(result['output_image_urls']) == 1
+        assert not os.path.exists(staged_path)
+        assert Image.query.count() == 1
+
+
+def test_task_progress_is_throttled_and_exposed(client, monkeypatch):
+    """Test that PROGRESS meta is published at most once per interval and returned by /status."""
+    import importlib
+    from types import SimpleNamespace
+    from app.utils.job_utils import TaskProgress
+
+    updates = []
+    task = SimpleNamespace(
+        request=SimpleNamespace(id='task-1'),
+        update_state=lambda state, meta: updates.append((state, meta))
+    )
+    progress = TaskProgress(task, 'fetch', images_total=3, interval=60)
+    progress.publish()
+    progress.advance(done=1, bytes_downloaded=10)
+    failure = {'input_image_url': 'http://a.example.com/x.png', 'reason': 'too_large', 'error': 'too big'}
+    progress.advance(failures=[failure])
+    assert len(updates) == 1
+
+    progress.publish(force=True)
+    state, meta = updates[-1]
+    assert state == 'PROGRESS'
+    assert (meta['images_done'], meta['images_failed'], meta['bytes_downloaded']) == (1, 1, 10)
+    assert meta['recent_failures'] == [failure]
+
+    # Tasks called directly have no backend state to update
+    direct = SimpleNamespace(request=SimpleNamespace(id=None), update_state=lambda **kwargs: 1 / 0)
+    TaskProgress(direct, 'fetch', 1).advance(done=1)
+
+    status_routes = importlib.import_module('app.routes.status_routes')
+    monkeypatch.setattr(status_routes, 'AsyncResult', lambda task_id, app: SimpleNamespace(state='PROGRESS', info=meta))
+    data = client.get('/status/task-1').get_json()
+    assert data['status'] == 'PROGRESS'
+    assert data['progress']['images_total'] == 3
+
+
+def test_host_guard_throttles_and_opens_breaker(tmp_path):
+    """Test the shared per-host token bucket and circuit breaker."""
+    from app.utils.host_guard import HostGuard
+
+    guard = HostGuard(str(tmp_path / 'hosts.sqlite3'), rate=1, burst=2, failure_threshold=2, open_seconds=60)
+    assert guard.acquire('a.example.com') == 0
+    assert guard.acquire('a.example.com') == 0
+    assert 0 < guard.acquire('a.example.com') <= 1
+    # Other hosts keep their own budget
+    assert guard.acquire('b.example.com') == 0
+
+    # State is shared with other processes through the file
+    other = HostGuard(guard.path, rate=1, burst=2, failure_threshold=2, open_seconds=60)
+    other.record_failure('b.example.com')
+    guard.record_failure('b.example.com')
+    assert guard.acquire('b.example.com') > 30
+
+    guard.record_success('b.example.com')
+    assert guard.acquire('b.example.com') == 0
+
+    # Once the breaker's open period ends only one trial request is let through
+    quick = HostGuard(str(tmp_path / 'trial.sqlite3'), rate=0, failure_threshold=1, open_seconds=0.2)
+    quick.acquire('c.example.com')
+    quick.record_failure('c.example.com')
+    time.sleep(0.25)
+    assert quick.acquire('c.example.com') == 0
+    assert quick.acquire('c.example.com') > 0
+    quick.record_success('c.example.com')
+    assert quick.acquire('c.example.com') == 0
+    assert quick.acquire('c.example.com') == 0
+
+
+def test_fetch_stage_defers_throttled_hosts(app, monkeypatch, tmp_path):
+    """Test that downloads from a host with an open breaker are deferred for a retry, then failed."""
+    from app.tasks import image_tasks
+    from app.utils import image_utils
+    from app.utils.host_guard import HostGuard
+    from app.utils.image_cache import ImageStore
+    from app.utils.job_utils import TaskProgress
+
+    server = FakeImageServer({
+        'http://slow.example.com/1.png': _png_bytes('red'),
+        'http://fast.example.com/2.png': _png_bytes('blue'),
+    })
+    guard = HostGuard(str(tmp_path / 'hosts.sqlite3'), failure_threshold=1, open_seconds=30)
+    guard.acquire('slow.example.com')
+    guard.record_failure('slow.example.com')
+    monkeypatch.setattr(image_utils, 'get_http_session', lambda guarded=False: server)
+    monkeypatch.setattr(image_tasks, 'host_guard', guard)
+    monkeypatch.setattr(image_tasks, 'image_store', ImageStore(str(tmp_path / 'images')))
+
+    urls = list(server.images)
+    progress = TaskProgress(image_tasks.process_images_task, 'fetch', len(urls))
+    manifest = image_tasks._fetch_product_images(progress, 1, urls, can_defer=True)
+    assert manifest['deferred'] == [0]
+    assert 0 < manifest['retry_after'] <= 30
+    assert [download['url'] for download in manifest['downloads']] == [urls[1]]
+    assert [url for url, _ in server.requests] == [urls[1]]
+
+    # The retry only fetches the deferred URL; once retries run out it is recorded as a failure
+    retried = image_tasks._fetch_product_images(progress, 1, urls, previous=manifest, can_defer=False)
+    assert retried['deferred'] == []
+    assert [download['url'] for download in retried['downloads']] == [urls[1]]
+    assert [failure['reason'] for failure in retried['failed_images']] == ['host_unavailable']
+    assert len(server.requests) == 1
+
+
+def test_refetch_after_eviction_goes_through_host_guard(app, monkeypatch, tmp_path):
+    """Test that re-downloading an image whose renditions vanished after a 304 still asks the host guard."""
+    import shutil
+    from app.tasks import image_tasks
+    from app.utils import image_utils
+    from app.utils.image_cache import ImageStore
+    from app.utils.job_utils import TaskProgress
+
+    class EvictingServer(FakeImageServer):
+        def get(self, url, timeout=None, headers=None, stream=False):
+            if headers:
+                # Evicted between deciding to revalidate and the 304 arriving
+                shutil.rmtree(tmp_path / 'images')
+            return super().get(url, timeout=timeout, headers=headers, stream=stream)
+
+    class ClosingGuard:
+        """Admits the first request, then reports the host as unavailable for a minute."""
+        acquired = 0
+
+        def acquire(self, host):
+            self.acquired += 1
+            return 0 if self.acquired == 1 else 60
+
+        def record_success(self, host):
+            pass
+
+        def record_failure(self, host):
+            pass
+
+    server = EvictingServer({'http://a.example.com/1.png': _png_bytes('red')})
+    monkeypatch.setattr(image_utils, 'get_http_session', lambda guarded=False: server)
+    monkeypatch.setattr(image_tasks, 'image_store', ImageStore(str(tmp_path / 'images')))
+    monkeypatch.setattr(image_tasks.Config, 'OUTPUT_CSV_DIR', str(tmp_path / 'csv'))
+
+    with app.app_context():
+        product = Product(serial_number='EVICT304', product_name='Evicted after 304')
+        db.session.add(product)
+        db.session.commit()
+        image_tasks.process_images_task(product.id, list(server.images))
+
+        guard = ClosingGuard()
+        monkeypatch.setattr(image_tasks, 'host_guard', guard)
+        progress = TaskProgress(image_tasks.process_images_task, 'fetch', 1)
+        manifest = image_tasks._fetch_product_images(progress, product.id, list(server.images), can_defer=True)
+        assert manifest['deferred'] == [0]
+        assert manifest['downloads'] == []
+        assert guard.acquired == 2
+        assert len(server.requests) == 2
+
+
+def test_memory_rate_limiter_sliding_window(monkeypatch):
+    """Test the in-memory limiter's sliding window and eviction of idle clients."""
+    from app.utils import rate_limiter
+
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, 'time', lambda: now[0])
+    limiter = rate_limiter.MemoryRateLimiter(sweep_interval=0)
+
+    assert [limiter.hit('a', 2, 10)[0] for _ in range(3)] == [True, True, False]
+    allowed, retry_after = limiter.hit('a', 2, 10)
+    assert not allowed and 1 <= retry_after <= 10
+
+    # Half way into the next window, the previous window's 2 hits still weigh 1
+    now[0] = 1015.0
+    assert limiter.hit('a', 2, 10) == (True, 0)
+    assert limiter.hit('a', 2, 10)[0] is False
+
+    limiter.hit('b', 2, 10)
+    now[0] = 1100.0
+    limiter.hit('c', 2, 10)
+    assert len(limiter) == 1
+
+    # A short-window endpoint must not sweep an hourly key that is still limiting
+    now[0] = 3600.0
+    assert [limiter.hit('hourly', 2, 3600)[0] for _ in range(3)] == [True, True, False]
+    now[0] = 3700.0
+    limiter.hit('minutely', 2, 60)
+    assert limiter.hit('hourly', 2, 3600)[0] is False
+
+
+def test_rate_limit_decorator_returns_retry_after(client, monkeypatch):
+    """Test that the rate_limit decorator rejects over-limit clients with a Retry-After header."""
+    from app import middleware
+
+    class DenyingLimiter:
+        def hit(self, key, limit, window_seconds):
+            assert key.startswith('list_products:')
+            return False, 7
+
+    monkeypatch.setattr(middleware, '_rate_limiter', DenyingLimiter())
+    response = client.get('/api/products')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '7'
+    assert response.get_json()['retry_after'] == 7
+
+
+def test_product_reads_are_cached_with_etags(app, client):
+    """Test product responses are served from cache, revalidated with ETags and invalidated on writes."""
+    response = client.post('/api/products', json={'serial_number': 'CACHE1', 'product_name': 'Cached'})
+    product_id = response.get_json()['id']
+
+    first = client.get(f'/api/products/{product_id}')
+    etag = first.headers['ETag']
+    assert first.get_json()['product_name'] == 'Cached'
+    assert client.get('/api/products').get_json()['products'][0]['product_name'] == 'Cached'
+
+    # A write that bypasses the API is not seen until the entry is invalidated
+    with app.app_context():
+        db.session.get(Product, product_id).product_name = 'Changed directly'
+        db.session.commit()
+    assert client.get(f'/api/products/{product_id}').get_json()['product_name'] == 'Cached'
+
+    not_modified = client.get(f'/api/products/{product_id}', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.data == b''
+
+    client.put(f'/api/products/{product_id}', json={'product_name': 'Renamed'})
+    renamed = client.get(f'/api/products/{product_id}', headers={'If-None-Match': etag})
+    assert renamed.status_code == 200
+    assert renamed.headers['ETag'] != etag
+    assert renamed.get_json()['product_name'] == 'Renamed'
+    assert client.get('/api/products').get_json()['products'][0]['product_name'] == 'Renamed'
+
+    client.delete(f'/api/products/{product_id}')
+    assert client.get(f'/api/products/{product_id}').status_code == 404
+
+
+def test_metrics_endpoint(client):
+    """Test /metrics exposes request latency by blueprint, endpoint and status."""
+    client.get('/api/products')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_bucket{' in body
+    assert 'blueprint="products",endpoint="products.list_products",method="GET",status="200"' in body
+    assert 'http_requests_in_flight' in body
+
+
+def test_health_endpoints_use_cached_checks(app, client, monkeypatch):
+    """Test /health/detailed serves the sampled snapshot and /health/ready reuses recent DB pings."""
+    from app.utils.health_monitor import HealthMonitor
+
+    monkeypatch.setattr(HealthMonitor, 'start', lambda self: None)
+    monitor = app.extensions['health_monitor']
+    monkeypatch.setattr(monitor, '_check_celery', lambda: {'status': 'healthy', 'workers': 1})
+
+    # The first request samples synchronously instead of reporting an empty snapshot
+    response = client.get('/health/detailed')
+    assert response.status_code == 200
+    detailed = response.get_json()
+    assert detailed['status'] == 'healthy'
+    assert detailed['checks']['database'] == {'status': 'healthy'}
+    assert detailed['checks']['celery']['workers'] == 1
+    assert detailed['age_seconds'] >= 0
+
+    pings = []
+    run_ping = monitor._run_ping
+    monkeypatch.setattr(monitor, '_run_ping', lambda: pings.append(1) or run_ping())
+    monitor._ping = None
+    for _ in range(3):
+        assert client.get('/health/ready').status_code == 200
+    assert len(pings) == 1
+
+
+def test_request_logs_are_sampled_and_structured(client, caplog, monkeypatch):
+    """Test successful requests are sampled, errors are always logged, and records format as JSON."""
+    import json
+    import logging
+    from app import middleware
+    from app.utils.log_utils import DroppingQueueHandler, JsonFormatter
+
+    monkeypatch.setattr(middleware.random, 'random', lambda: 0.99)
+    with caplog.at_level(logging.INFO, logger='app.middleware'):
+        client.get('/api/products')
+        client.get('/api/products/999999')
+    records = [r for r in caplog.records if r.name == 'app.middleware']
+    assert [r.status for r in records] == [404]
+    assert records[0].path == '/api/products/999999'
+
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        record = logging.getLogger('app.test').makeRecord(
+            'app.test', logging.ERROR, __file__, 1, 'failed %s', ('job',), sys.exc_info(), extra={'job_id': 7}
+        )
+    entry = json.loads(JsonFormatter().format(DroppingQueueHandler(None).prepare(record)))
+    assert entry['message'] == 'failed job'
+    assert entry['job_id'] == 7
+    assert entry['level'] == 'ERROR'
+    assert 'ValueError: boom' in entry['exception']
+
+
+def test_engine_options_from_config(tmp_path):
+    """Test pool settings become engine options, with PgBouncer mode and checkout wait metrics."""
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import NullPool
+    from app.config import Config
+    from app.metrics import DB_POOL_CHECKOUT_WAIT, TimedQueuePool
+    from app.utils.db_utils import engine_options
+
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    config.update(SQLALCHEMY_DATABASE_URI='postgresql://user:secret@db:5432/app', DB_POOL_SIZE=3,
+                  DB_STATEMENT_TIMEOUT_MS=5000, DB_PGBOUNCER=0)
+    options = engine_options(config)
+    assert options['poolclass'] is TimedQueuePool
+    assert options['pool_size'] == 3
+    assert options['pool_pre_ping'] is True
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+
+    assert engine_options(dict(config, DB_PGBOUNCER=1)) == {'poolclass': NullPool}
+    assert engine_options(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///test.db')) == {}
+
+    def checkouts():
+        return sum(s.value for s in DB_POOL_CHECKOUT_WAIT.collect()[0].samples if s.name.endswith('_count'))
+
+    before = checkouts()
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool, pool_size=1)
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+    engine.dispose()
+    assert checkouts() == before + 1
+
+
+def test_failed_batch_still_completes_job(app, monkeypatch, tmp_path):
+    """Test a batch that fails as a whole is counted as completed with every image failed."""
+    from app.models import UploadJob
+    from app.tasks import image_tasks
+
+    monkeypatch.setattr(image_tasks.Config, 'OUTPUT_CSV_DIR', str(tmp_path / 'csv'))
+
+    def broken_save(image_rows, source_updates):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(image_tasks, '_save_results', broken_save)
+    with app.app_context():
+        db.session.add(UploadJob(id='job2', status='QUEUED', total_batches=1))
+        db.session.commit()
+
+        urls = ['http://a.example.com/1.png', 'http://a.example.com/2.png']
+        manifests = [image_tasks._empty_manifest(999, urls, None)]
+        with pytest.raises(RuntimeError):
+            image_tasks.transform_product_batch_task('job2', manifests)
+
+        job = db.session.get(UploadJob, 'job2')
+        assert job.status == 'COMPLETED'
+        assert job.completed_batches == 1
+        assert job.images_failed == 2
+
+
+def test_upload_csv_ingests_inline_without_shared_storage(app, client, monkeypatch, tmp_path):
+    """Test uploads are parsed by the web process when workers cannot read its upload folder."""
+    import io
+    import importlib
+    upload_module = importlib.import_module('app.routes.upload_routes')
+    upload_tasks = importlib.import_module('app.tasks.upload_tasks')
+
+    dispatched = []
+
+    class FakeBatchTask:
+        @staticmethod
+        def delay(job_id, items, renditions=None):
+            dispatched.append((job_id, items))
+
+    monkeypatch.setattr(upload_module.Config, 'UPLOAD_SHARED_STORAGE', 0)
+    monkeypatch.setattr(upload_tasks, 'process_product_batch_task', FakeBatchTask)
+    monkeypatch.setattr(upload_tasks.Config, 'UPLOAD_FOLDER', str(tmp_path))
+
+    csv_body = 'Serial Number,Product Name,Input Image Urls\nSN9,Inline,http://example.com/a.jpg\n'
+    response = client.post(
+        '/upload',
+        data={'file': (io.BytesIO(csv_body.encode()), 'products.csv')},
+        content_type='multipart/form-data',
+    )
+    assert response.status_code == 202
+    data = response.get_json()
+    assert data['status'] == 'QUEUED'
+    assert data['total_rows'] == 1
+    assert [job_id for job_id, _ in dispatched] == [data['job_id']]
+    assert not list(tmp_path.iterdir())
+
+
+def test_per_page_is_clamped(app, client):
+    """Test zero or negative per_page values return one item per page instead of failing."""
+    with app.app_context():
+        for i in range(3):
+            product = Product(serial_number=f'CLAMP{i}', product_name=f'Clamp {i}')
+            db.session.add(product)
+            db.session.flush()
+            db.session.add(Image(product_id=product.id, input_image_url=f'http://example.com/{i}.jpg'))
+        db.session.commit()
+
+    for per_page in (0, -5):
+        products = client.get(f'/api/products?cursor=&per_page={per_page}')
+        assert products.status_code == 200
+        assert len(products.get_json()['products']) == 1
+        assert products.get_json()['pagination']['per_page'] == 1
+
+        images = client.get(f'/api/products/images?per_page={per_page}')
+        assert images.status_code == 200
+        assert len(images.get_json()['images']) == 1
+        assert images.get_json()['pagination']['has_next'] is True
+
+
+def test_fetch_images_holds_only_in_flight_bodies():
+    """Test downloads are submitted through a bounded window and released once yielded."""
+    import tracemalloc
+    from app.utils.image_utils import fetch_images
+
+    body = b'x' * (1024 * 1024)
+    server = FakeImageServer({f'http://a.example.com/{i}.png': body for i in range(20)})
+
+    tracemalloc.start()
+    try:
+        count = 0
+        for _, _, result, error in fetch_images(list(server.images), max_workers=2, session=server):
+            assert error is None and len(result.content) == len(body)
+            count += 1
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert count == 20
+    assert peak < 10 * len(body)
+
+
+def test_rate_limit_keys_on_forwarded_client(monkeypatch):
+    """Test the rate limiter sees the client address from a trusted proxy's X-Forwarded-For."""
+    from app import middleware
+    from app.config import Config
+
+    keys = []
+
+    class RecordingLimiter:
+        def hit(self, key, limit, window_seconds):
+            keys.append(key)
+            return True, 0
+
+    monkeypatch.setattr(Config, 'PROXY_FIX_X_FOR', 1)
+    monkeypatch.setattr(middleware, '_rate_limiter', RecordingLimiter())
+    client = create_app().test_client()
+    client.get('/api/products', headers={'X-Forwarded-For': '203.0.113.7'}, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert keys == ['list_products:203.0.113.7']
+
+
+def test_product_detail_read_racing_a_write_is_not_cached(app, client, monkeypatch):
+    """Test a detail response computed before an invalidation is served but not stored."""
+    import importlib
+    products_module = importlib.import_module('app.routes.products_routes')
+    from app.utils.response_cache import invalidate_products
+
+    response = client.post('/api/products', json={'serial_number': 'RACE1', 'product_name': 'Before'})
+    product_id = response.get_json()['id']
+    original_query = products_module.Product.query
+
+    class RacingQuery:
+        """Reads the product, then lets a concurrent write commit and invalidate before the view returns."""
+
+        def get_or_404(self, ident):
+            product = original_query.get_or_404(ident)
+            invalidate_products([ident])
+            return product
+
+        def __getattr__(self, name):
+            return getattr(original_query, name)
+
+    monkeypatch.setattr(products_module.Product, 'query', RacingQuery())
+    client.get(f'/api/products/{product_id}')
+    monkeypatch.undo()
+
+    cache = app.extensions['product_cache']
+    assert cache.get(f'product:{product_id}') is None
+
+
+def test_pool_capacity_reported_on_first_connection(tmp_path):
+    """Test pool gauges are set by the process that connects, not by merely creating the engine."""
+    from sqlalchemy import create_engine, text
+    from app.metrics import DB_POOL_SIZE, TimedQueuePool, instrument_engine
+
+    DB_POOL_SIZE.set(0)
+    engine = create_engine(f"sqlite:///{tmp_path / 'gauge.db'}", poolclass=TimedQueuePool, pool_size=3)
+    instrument_engine(engine)
+    assert DB_POOL_SIZE._value.get() == 0
+
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+    engine.dispose()
+    assert DB_POOL_SIZE._value.get() == 3